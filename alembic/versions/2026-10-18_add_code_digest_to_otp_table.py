@@ -0,0 +1,42 @@
+"""Add code digest to otp table.
+
+Revision ID: 4cde1b6c74fb
+Revises: cf923dbe481d
+Create Date: 2026-10-18 03:10:54.956637
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '4cde1b6c74fb'
+down_revision: Union[str, Sequence[str], None] = 'cf923dbe481d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        "otp",
+        sa.Column("code_digest", sa.LargeBinary(length=32), nullable=True)
+    )
+    op.alter_column(
+        "otp", "hashed_code",
+        existing_type=sa.String(length=128),
+        nullable=True
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # OTP rows live for a couple of minutes, codes that only have a digest can simply be dropped.
+    op.execute("DELETE FROM otp WHERE hashed_code IS NULL")
+    op.alter_column(
+        "otp", "hashed_code",
+        existing_type=sa.String(length=128),
+        nullable=False
+    )
+    op.drop_column("otp", "code_digest")
@@ -0,0 +1,27 @@
+"""Add created_at, id index to users table.
+
+Revision ID: cac134e22d41
+Revises: e9c15b0ce647
+Create Date: 2026-10-18 05:24:13.008900
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'cac134e22d41'
+down_revision: Union[str, Sequence[str], None] = 'e9c15b0ce647'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index("ix_users_created_at_id", "users", ["created_at", "id"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_users_created_at_id", table_name="users")
@@ -0,0 +1,37 @@
+"""Add email outbox table.
+
+Revision ID: e9c15b0ce647
+Revises: 3b5b0fea64ec
+Create Date: 2026-10-18 05:05:21.860661
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'e9c15b0ce647'
+down_revision: Union[str, Sequence[str], None] = '3b5b0fea64ec'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "email_outbox",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("recipient", sa.String(length=50), nullable=False),
+        sa.Column("subject", sa.String(length=255), nullable=False),
+        sa.Column("body", sa.Text, nullable=False),
+        sa.Column("attempts", sa.Integer, nullable=False, server_default="0"),
+        sa.Column("available_at", sa.DateTime(timezone=True), nullable=False)
+    )
+    op.create_index("ix_email_outbox_available_at", "email_outbox", ["available_at"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_email_outbox_available_at", table_name="email_outbox")
+    op.drop_table("email_outbox")
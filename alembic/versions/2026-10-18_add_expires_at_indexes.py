@@ -0,0 +1,36 @@
+"""Add expires_at indexes for expired row purges.
+
+Revision ID: 1061c1ce3127
+Revises: 4508da6b04d9
+Create Date: 2026-10-18 04:50:07.517582
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '1061c1ce3127'
+down_revision: Union[str, Sequence[str], None] = '4508da6b04d9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+INDEXES = (
+    ("ix_otp_expires_at", "otp"),
+    ("ix_otp_blacklist_expires_at", "otp_blacklist"),
+    ("ix_refresh_token_family_expires_at", "refresh_token_family"),
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    for name, table in INDEXES:
+        op.create_index(name, table, ["expires_at"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    for name, table in INDEXES:
+        op.drop_index(name, table_name=table)
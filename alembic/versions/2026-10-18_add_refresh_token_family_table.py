@@ -0,0 +1,68 @@
+"""Replace refresh token blacklist with refresh token families.
+
+Revision ID: 4508da6b04d9
+Revises: 4ca3f9acc08b
+Create Date: 2026-10-18 04:46:22.570925
+
+"""
+from datetime import datetime, timezone
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '4508da6b04d9'
+down_revision: Union[str, Sequence[str], None] = '4ca3f9acc08b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+refresh_token_blacklist = sa.table(
+    "refresh_token_blacklist",
+    sa.column("jti_hash", sa.LargeBinary),
+    sa.column("expires_at", sa.DateTime(timezone=True)),
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    refresh_token_family = op.create_table(
+        "refresh_token_family",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("family_id", sa.String(length=64), nullable=False),
+        sa.Column("generation", sa.Integer, nullable=False),
+        sa.Column("expires_at", sa.DateTime(timezone=True), nullable=False)
+    )
+    op.create_index("ix_refresh_token_family_family_id", "refresh_token_family", ["family_id"], unique=True)
+
+    # Refresh tokens used before families existed get a family keyed by their jti digest, already
+    # past its first generation, so presenting them again is still rejected.
+    conn = op.get_bind()
+    rows = conn.execute(
+        sa.select(refresh_token_blacklist.c.jti_hash, refresh_token_blacklist.c.expires_at)
+        .where(refresh_token_blacklist.c.expires_at > datetime.now(tz=timezone.utc))
+    ).all()
+    if rows:
+        op.bulk_insert(
+            refresh_token_family,
+            [{"family_id": jti_hash.hex(), "generation": 1, "expires_at": expires_at} for jti_hash, expires_at in rows]
+        )
+
+    op.drop_index("ix_refresh_token_blacklist_jti_hash", table_name="refresh_token_blacklist")
+    op.drop_table("refresh_token_blacklist")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.create_table(
+        "refresh_token_blacklist",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("jti_hash", sa.LargeBinary(length=32), nullable=False),
+        sa.Column("expires_at", sa.DateTime(timezone=True), nullable=False)
+    )
+    op.create_index(
+        "ix_refresh_token_blacklist_jti_hash", "refresh_token_blacklist", ["jti_hash"], unique=True
+    )
+    op.drop_index("ix_refresh_token_family_family_id", table_name="refresh_token_family")
+    op.drop_table("refresh_token_family")
@@ -0,0 +1,30 @@
+"""Add token version field to user table.
+
+Revision ID: 23a53f52c8c9
+Revises: 4cde1b6c74fb
+Create Date: 2026-10-18 03:55:00.349376
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '23a53f52c8c9'
+down_revision: Union[str, Sequence[str], None] = '4cde1b6c74fb'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        "users",
+        sa.Column("token_version", sa.Integer, nullable=False, server_default="0")
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column("users", "token_version")
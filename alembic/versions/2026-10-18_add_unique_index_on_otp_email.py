@@ -0,0 +1,29 @@
+"""Add unique index on otp email.
+
+Revision ID: b6af94e85cd6
+Revises: 1061c1ce3127
+Create Date: 2026-10-18 04:52:32.585796
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'b6af94e85cd6'
+down_revision: Union[str, Sequence[str], None] = '1061c1ce3127'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Concurrent requests could create several rows per email, keep the latest one.
+    op.execute("DELETE FROM otp WHERE id NOT IN (SELECT MAX(id) FROM otp GROUP BY email)")
+    op.create_index("ix_otp_email", "otp", ["email"], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_otp_email", table_name="otp")
@@ -0,0 +1,30 @@
+"""Add verify attempts field to otp table.
+
+Revision ID: 3b5b0fea64ec
+Revises: b6af94e85cd6
+Create Date: 2026-10-18 04:55:17.084699
+
+"""
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '3b5b0fea64ec'
+down_revision: Union[str, Sequence[str], None] = 'b6af94e85cd6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        "otp",
+        sa.Column("verify_attempts", sa.Integer, nullable=False, server_default="0")
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column("otp", "verify_attempts")
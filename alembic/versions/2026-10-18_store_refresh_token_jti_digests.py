@@ -0,0 +1,80 @@
+"""Store refresh token jti digests instead of full tokens.
+
+Revision ID: 4ca3f9acc08b
+Revises: 23a53f52c8c9
+Create Date: 2026-10-18 04:43:52.000964
+
+"""
+import base64
+import hashlib
+import json
+import time
+from datetime import datetime, timezone
+from typing import Sequence, Union
+
+import sqlalchemy as sa
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = '4ca3f9acc08b'
+down_revision: Union[str, Sequence[str], None] = '23a53f52c8c9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+refresh_token_blacklist = sa.table(
+    "refresh_token_blacklist",
+    sa.column("id", sa.Integer),
+    sa.column("refresh", sa.String),
+    sa.column("jti_hash", sa.LargeBinary),
+    sa.column("expires_at", sa.DateTime(timezone=True)),
+)
+
+
+def _token_expiry(token: str) -> int | None:
+    try:
+        payload = token.split(".")[1]
+        return int(json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column("refresh_token_blacklist", sa.Column("jti_hash", sa.LargeBinary(length=32), nullable=True))
+    op.add_column("refresh_token_blacklist", sa.Column("expires_at", sa.DateTime(timezone=True), nullable=True))
+
+    # Tokens stored before jtis existed are identified by the SHA-256 of the whole token, only the
+    # ones that haven't expired yet are worth keeping.
+    conn = op.get_bind()
+    now = time.time()
+    rows = conn.execute(sa.select(refresh_token_blacklist.c.id, refresh_token_blacklist.c.refresh))
+    for row_id, token in rows.all():
+        expires_at = _token_expiry(token)
+        if expires_at is None or expires_at <= now:
+            continue
+        jti = hashlib.sha256(token.encode()).hexdigest()
+        conn.execute(
+            refresh_token_blacklist.update().where(refresh_token_blacklist.c.id == row_id).values(
+                jti_hash=hashlib.sha256(jti.encode()).digest(),
+                expires_at=datetime.fromtimestamp(expires_at, tz=timezone.utc)
+            )
+        )
+    conn.execute(refresh_token_blacklist.delete().where(refresh_token_blacklist.c.jti_hash.is_(None)))
+
+    op.drop_column("refresh_token_blacklist", "refresh")
+    op.alter_column("refresh_token_blacklist", "jti_hash", nullable=False)
+    op.alter_column("refresh_token_blacklist", "expires_at", nullable=False)
+    op.create_index(
+        "ix_refresh_token_blacklist_jti_hash", "refresh_token_blacklist", ["jti_hash"], unique=True
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # The original tokens can't be recovered from their digests.
+    op.execute(refresh_token_blacklist.delete())
+    op.drop_index("ix_refresh_token_blacklist_jti_hash", table_name="refresh_token_blacklist")
+    op.drop_column("refresh_token_blacklist", "expires_at")
+    op.drop_column("refresh_token_blacklist", "jti_hash")
+    op.add_column("refresh_token_blacklist", sa.Column("refresh", sa.String, nullable=False))
@@ -0,0 +1,178 @@
+"""
+End-to-end benchmark for OTP email delivery through send_otp_code_email and EmailHandler.
+
+Starts a local SMTP sink and drives the Celery tasks either eagerly (tasks run in the calling
+threads) or through in-process Celery workers, over the in-memory broker by default or a local
+Redis given with --broker. Every combination of concurrency, SMTP pool size and batch size
+is run, batch sizes above 1 go through send_otp_code_emails. Reports messages/sec and the
+enqueue to SMTP-accepted latency percentiles. Runs offline, STARTTLS and login are skipped.
+
+Usage: python -m benchmarks.email_delivery --mode eager worker --messages 2000 --concurrency 1 8 --pool-sizes 1 8 --batch-sizes 1 50
+"""
+import argparse
+import itertools
+import socketserver
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+
+from celery.contrib.testing.worker import start_worker
+
+from src.apps import tasks
+from src.apps.tasks import send_otp_code_email, send_otp_code_emails
+from src.core.metrics import Histogram
+from src.core.settings import configs
+from src.infrastructure.celery_app import celery_app
+from src.infrastructure.email_handler import smtp_pool
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """Accepts every message and records when each recipient's message was accepted."""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), SMTPSinkHandler)
+        self.lock = threading.Lock()
+        self.accepted_at: dict[str, float] = {}
+
+    def accept(self, recipients: list[str]):
+        now = time.perf_counter()
+        with self.lock:
+            for recipient in recipients:
+                self.accepted_at[recipient] = now
+
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    def reply(self, line: str):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        self.reply("220 benchmark sink")
+        recipients = []
+        for raw_line in self.rfile:
+            command = raw_line.decode().strip()
+            verb = command[:4].upper()
+            if verb in ("EHLO", "HELO"):
+                self.reply("250 benchmark")
+            elif verb == "MAIL":
+                recipients = []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                recipients.append(command.partition(":")[2].strip().strip("<>"))
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                for data_line in self.rfile:
+                    if data_line == b".\r\n":
+                        break
+                self.server.accept(recipients)
+                self.reply("250 OK")
+            elif verb in ("RSET", "NOOP"):
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+def run(sink: SMTPSink, messages: int, concurrency: int, batch_size: int, timeout: float) -> dict:
+    recipients = [f"user{index}@benchmark.local" for index in range(messages)]
+    batches = [recipients[start:start + batch_size] for start in range(0, messages, batch_size)]
+    enqueued_at: dict[str, float] = {}
+    sink.accepted_at.clear()
+
+    def enqueue(batch: list[str]):
+        now = time.perf_counter()
+        for recipient in batch:
+            enqueued_at[recipient] = now
+        if batch_size == 1:
+            send_otp_code_email.delay(batch[0], "123456")
+        else:
+            send_otp_code_emails.delay([(recipient, "123456") for recipient in batch])
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(enqueue, batches))
+
+    deadline = time.monotonic() + timeout
+    while len(sink.accepted_at) < messages and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    accepted = dict(sink.accepted_at)
+    latencies = sorted(accepted[recipient] - enqueued_at[recipient] for recipient in accepted)
+    elapsed = max(accepted.values(), default=started) - started
+    return {
+        "delivered": len(accepted),
+        "per_second": len(accepted) / elapsed if elapsed > 0 else 0.0,
+        "p50": percentile(latencies, 0.50) * 1000 if latencies else float("nan"),
+        "p95": percentile(latencies, 0.95) * 1000 if latencies else float("nan"),
+        "p99": percentile(latencies, 0.99) * 1000 if latencies else float("nan"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark OTP email delivery against a local SMTP sink.")
+    parser.add_argument("--mode", nargs="+", choices=["eager", "worker"], default=["eager", "worker"])
+    parser.add_argument("--messages", type=int, default=1_000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--pool-sizes", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 50])
+    parser.add_argument("--broker", default="memory://", help="Broker of the worker mode, e.g. a local Redis.")
+    parser.add_argument("--timeout", type=float, default=120, help="Seconds to wait for a run to be delivered.")
+    args = parser.parse_args()
+
+    sink = SMTPSink()
+    threading.Thread(target=sink.serve_forever, daemon=True).start()
+
+    configs.EMAIL_HOSTNAME, configs.EMAIL_PORT = sink.server_address
+    configs.EMAIL_USE_TLS = False
+    configs.EMAIL_HOST_USERNAME = configs.EMAIL_HOST_USERNAME or "otp@benchmark.local"
+    # Keep the run offline, the delivery histogram normally lives in Redis.
+    tasks.email_delivery_seconds = Histogram("email_delivery_seconds", "")
+    celery_app.conf.update(
+        broker_url=args.broker,
+        broker_transport_options={"polling_interval": 0.01},
+        result_backend=None,
+        task_ignore_result=True
+    )
+
+    print(f"{args.messages} messages per run, SMTP sink on {configs.EMAIL_HOSTNAME}:{configs.EMAIL_PORT}")
+    print(f"{'mode':<8}{'conc':>6}{'pool':>6}{'batch':>7}{'sent':>8}{'msg/s':>10}"
+          f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+
+    for mode in args.mode:
+        for concurrency, pool_size, batch_size in itertools.product(args.concurrency, args.pool_sizes, args.batch_sizes):
+            smtp_pool.clear()
+            smtp_pool.size = pool_size
+
+            if mode == "eager":
+                celery_app.conf.task_always_eager = True
+                result = run(sink, args.messages, concurrency, batch_size, args.timeout)
+            else:
+                celery_app.conf.task_always_eager = False
+                # One solo worker per unit of concurrency: a threads pool worker only acks between polls
+                # of the in-memory broker, which would dominate the latency.
+                with ExitStack() as workers:
+                    for index in range(concurrency):
+                        workers.enter_context(start_worker(
+                            celery_app, pool="solo", queues=["otp"], hostname=f"benchmark{index}@localhost",
+                            perform_ping_check=False, shutdown_timeout=args.timeout
+                        ))
+                    result = run(sink, args.messages, concurrency, batch_size, args.timeout)
+
+            print(f"{mode:<8}{concurrency:>6}{pool_size:>6}{batch_size:>7}{result['delivered']:>8}"
+                  f"{result['per_second']:>10,.0f}{result['p50']:>10.1f}{result['p95']:>10.1f}{result['p99']:>10.1f}")
+
+    sink.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Micro-benchmark for minting and verifying access tokens.
+
+Compares the python-jose implementation tokens used to go through (full claim set, pytz lookup per
+call) with the Authlib and native backends of src.apps.auth.tokens, using in-memory keys.
+
+Usage: python -m benchmarks.tokens --algorithm HS256 --iterations 20000
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from authlib.jose import OctKey, OKPKey
+
+from src.apps.auth.keys import KeyRing
+from src.apps.auth.tokens import NativeBackend
+
+SECRET_KEY = "benchmark-secret-key-benchmark-secret-key"
+TIMEZONE = "UTC"
+
+
+def compact_payload() -> dict:
+    return {"sub": "1", "typ": "access", "ver": 0, "exp": int(time.time() + 900), "rol": "user", "act": True}
+
+
+def legacy_backend(algorithm: str):
+    try:
+        import pytz
+        from jose import jwt
+    except ImportError:
+        return None
+    if algorithm != "HS256":
+        return None
+
+    def mint(_=None) -> str:
+        payload = {
+            "user_id": 1, "email": "benchmark@example.com", "token_type": "access", "ver": 0,
+            "role": "user", "active": True
+        }
+        exp = datetime.now(tz=pytz.timezone(TIMEZONE)) + timedelta(minutes=15)
+        payload.update({"exp": int(exp.timestamp())})
+        return jwt.encode(payload, SECRET_KEY, algorithm="HS256")
+
+    def verify(token: str) -> dict:
+        return jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+
+    return mint, verify
+
+
+def key_ring_for(algorithm: str) -> KeyRing:
+    if algorithm == "HS256":
+        return KeyRing("HS256", [OctKey.import_key(SECRET_KEY)])
+    return KeyRing("EdDSA", [OKPKey.generate_key("Ed25519", {"kid": "benchmark"}, is_private=True)])
+
+
+def ops_per_second(function, argument, iterations: int) -> float:
+    started = time.perf_counter()
+    for _ in range(iterations):
+        function(argument)
+    return iterations / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark access token mint/verify throughput.")
+    parser.add_argument("--algorithm", choices=["HS256", "EdDSA"], default="HS256")
+    parser.add_argument("--iterations", type=int, default=20_000)
+    args = parser.parse_args()
+
+    key_ring = key_ring_for(args.algorithm)
+    backends = {}
+    if (legacy := legacy_backend(args.algorithm)) is not None:
+        backends["python-jose (legacy)"] = legacy
+    for name, backend in (("authlib", key_ring), ("native", NativeBackend(key_ring))):
+        backends[name] = (lambda _, backend=backend: backend.encode(compact_payload()), backend.decode)
+
+    print(f"{args.algorithm}, {args.iterations} iterations")
+    print(f"{'backend':<22}{'mint ops/s':>14}{'verify ops/s':>14}{'token bytes':>13}")
+    for name, (mint, verify) in backends.items():
+        token = mint(None)
+        minted = ops_per_second(mint, None, args.iterations)
+        verified = ops_per_second(verify, token, args.iterations)
+        print(f"{name:<22}{minted:>14,.0f}{verified:>14,.0f}{len(token):>13}")
+
+
+if __name__ == "__main__":
+    main()
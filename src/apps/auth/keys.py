@@ -0,0 +1,81 @@
+from pathlib import Path
+
+from authlib.jose import JsonWebKey, JsonWebToken, KeySet, OctKey
+from authlib.jose.errors import JoseError
+
+from src.core.settings import configs, GlobalConfig
+
+
+KEY_TYPES = {"RS256": "RSA", "EdDSA": "OKP"}
+
+
+class InvalidTokenError(Exception):
+    pass
+
+
+class KeyRing:
+    """
+    Keys used to sign and verify JWTs.
+
+    The first key signs every new token; the remaining keys are still published and accepted so
+    tokens signed before a rotation stay valid until they expire. To rotate, append the new key,
+    wait for JWKS caches to pick it up, move it to the front, and drop the old key once the longest
+    lived token signed with it has expired.
+    """
+
+    def __init__(self, algorithm: str, keys: list):
+        if not keys:
+            raise ValueError("At least one JWT signing key is required.")
+        self.algorithm = algorithm
+        self.keys = keys
+        self.signing_key = keys[0]
+        self.key_set = KeySet(keys)
+        self.jwt = JsonWebToken([algorithm])
+
+    @property
+    def is_symmetric(self) -> bool:
+        return self.algorithm.startswith("HS")
+
+    def encode(self, payload: dict) -> str:
+        header = {"alg": self.algorithm, "typ": "JWT"}
+        if not self.is_symmetric:
+            header["kid"] = self.signing_key.kid
+        return self.jwt.encode(header, payload, self.signing_key).decode()
+
+    def decode(self, token: str) -> dict:
+        key = self.signing_key if self.is_symmetric else self.key_set
+        try:
+            claims = self.jwt.decode(token, key)
+            claims.validate()
+        except (JoseError, ValueError) as e:
+            raise InvalidTokenError(str(e)) from e
+        return dict(claims)
+
+    def jwks(self) -> dict:
+        if self.is_symmetric:
+            return {"keys": []}
+        return {
+            "keys": [
+                {**key.as_dict(is_private=False), "use": "sig", "alg": self.algorithm}
+                for key in self.keys
+            ]
+        }
+
+
+def load_private_key(path: str, algorithm: str):
+    pem = Path(path).read_bytes()
+    key = JsonWebKey.import_key(pem)
+    if key.kty != KEY_TYPES[algorithm]:
+        raise ValueError(f"{path} is a {key.kty} key, {algorithm} needs a {KEY_TYPES[algorithm]} key.")
+    # RFC 7638 thumbprints give every key a stable kid without having to configure one.
+    return JsonWebKey.import_key(pem, {"kid": key.thumbprint(), "alg": algorithm})
+
+
+def load_key_ring(config: GlobalConfig) -> KeyRing:
+    if config.JWT_ALGORITHM == "HS256":
+        return KeyRing("HS256", [OctKey.import_key(config.SECRET_KEY)])
+    keys = [load_private_key(path, config.JWT_ALGORITHM) for path in config.JWT_PRIVATE_KEY_FILES]
+    return KeyRing(config.JWT_ALGORITHM, keys)
+
+
+key_ring = load_key_ring(configs)
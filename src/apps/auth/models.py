@@ -1,6 +1,6 @@
-from datetime import datetime
+from datetime import datetime, timezone
 
-from sqlalchemy import String, DateTime
+from sqlalchemy import String, DateTime, LargeBinary, Text
 from sqlalchemy.orm import Mapped, mapped_column
 
 from src.infrastructure.database import Base
@@ -10,10 +10,12 @@ class Otp(Base):
     __tablename__ = "otp"
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    email: Mapped[str] = mapped_column(String(length=50), nullable=False)
-    hashed_code: Mapped[str] = mapped_column(String(length=128), nullable=False)
+    email: Mapped[str] = mapped_column(String(length=50), unique=True, index=True, nullable=False)
+    hashed_code: Mapped[str | None] = mapped_column(String(length=128), nullable=True)
+    code_digest: Mapped[bytes | None] = mapped_column(LargeBinary(length=32), nullable=True)
     attempts: Mapped[int] = mapped_column(default=1, nullable=False)
-    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=False)
+    verify_attempts: Mapped[int] = mapped_column(default=0, server_default="0", nullable=False)
+    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), index=True, nullable=False)
 
 
 class OtpBlacklist(Base):
@@ -21,11 +23,27 @@ class OtpBlacklist(Base):
 
     id: Mapped[int] = mapped_column(primary_key=True)
     email: Mapped[str] = mapped_column(String(length=50), unique=True, nullable=False)
-    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), nullable=True)
+    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), index=True, nullable=True)
 
 
-class RefreshTokenBlacklist(Base):
-    __tablename__ = "refresh_token_blacklist"
+class RefreshTokenFamily(Base):
+    __tablename__ = "refresh_token_family"
 
     id: Mapped[int] = mapped_column(primary_key=True)
-    refresh: Mapped[str] = mapped_column(nullable=False)
+    family_id: Mapped[str] = mapped_column(String(length=64), unique=True, index=True, nullable=False)
+    generation: Mapped[int] = mapped_column(default=0, nullable=False)
+    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), index=True, nullable=False)
+
+
+class EmailOutbox(Base):
+    __tablename__ = "email_outbox"
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+    recipient: Mapped[str] = mapped_column(String(length=50), nullable=False)
+    subject: Mapped[str] = mapped_column(String(length=255), nullable=False)
+    # Encrypted, see outbox.seal_body.
+    body: Mapped[str] = mapped_column(Text, nullable=False)
+    attempts: Mapped[int] = mapped_column(default=0, server_default="0", nullable=False)
+    available_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), default=lambda: datetime.now(tz=timezone.utc), index=True, nullable=False
+    )
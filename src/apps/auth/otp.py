@@ -0,0 +1,223 @@
+import hashlib
+import hmac
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime
+from functools import lru_cache
+
+from sqlalchemy import update, Row
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.core.hashing import hash_async, verify_async
+from src.core.settings import configs, GlobalConfig
+from src.infrastructure.redis_pool import redis_fastapi
+from .models import Otp
+from .repository import get_otp_by_email
+
+# KEYS[1] otp record; ARGV[1] code digest, ARGV[2] code expiry, ARGV[3] max attempts, ARGV[4] record ttl
+ISSUE_SCRIPT = """
+local attempts = tonumber(redis.call('HGET', KEYS[1], 'attempts') or '0')
+if attempts >= tonumber(ARGV[3]) then
+    return -1
+end
+redis.call('HSET', KEYS[1], 'digest', ARGV[1], 'attempts', attempts + 1, 'expires_at', ARGV[2], 'verify_attempts', 0)
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return attempts + 1
+"""
+
+# KEYS[1] otp record; ARGV[1] code digest, ARGV[2] now, ARGV[3] max verify attempts
+VERIFY_SCRIPT = """
+local record = redis.call('HMGET', KEYS[1], 'digest', 'expires_at', 'verify_attempts')
+if not record[1] or tonumber(record[2]) < tonumber(ARGV[2]) or tonumber(record[3] or '0') >= tonumber(ARGV[3]) then
+    return 0
+end
+redis.call('HINCRBY', KEYS[1], 'verify_attempts', 1)
+if record[1] ~= ARGV[1] then
+    return 0
+end
+return 1
+"""
+
+# KEYS[1] otp record; ARGV[1] code digest
+CONSUME_SCRIPT = """
+if redis.call('HGET', KEYS[1], 'digest') == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+@lru_cache()
+def get_otp_pepper() -> bytes:
+    if configs.OTP_PEPPER:
+        return configs.OTP_PEPPER.encode()
+    # Derive a dedicated key so the OTP digests never share a key with the JWT signatures.
+    return hmac.new(configs.SECRET_KEY.encode(), b"fastauth-otp-pepper", hashlib.sha256).digest()
+
+
+def otp_digest(email: str, otp_code: str) -> bytes:
+    # The email is part of the message so a digest can't be replayed against another address.
+    message = f"{email}:{otp_code}".encode()
+    return hmac.new(get_otp_pepper(), message, hashlib.sha256).digest()
+
+
+async def hash_otp_code(email: str, otp_code: str) -> dict:
+    """Returns the column values that store ``otp_code`` for the configured OTP hashing mode."""
+    if configs.OTP_HASHING_MODE == "argon2":
+        return {"hashed_code": await hash_async(otp_code), "code_digest": None}
+    return {"hashed_code": None, "code_digest": otp_digest(email, otp_code)}
+
+
+async def verify_otp_code(otp_obj: Otp | Row, otp_code: str) -> bool:
+    if otp_obj.code_digest is not None:
+        return hmac.compare_digest(otp_obj.code_digest, otp_digest(otp_obj.email, otp_code))
+
+    # Rows written before the HMAC mode (or with OTP_HASHING_MODE=argon2) only have an argon2 hash.
+    if otp_obj.hashed_code is not None:
+        return await verify_async(otp_obj.hashed_code, otp_code)
+
+    return False
+
+
+@dataclass
+class RedisOtp:
+    """Handle on the OTP record of an email in Redis, remembers the code once it has been verified."""
+    email: str
+    code_digest: bytes | None = None
+
+
+class OtpStore(ABC):
+    @abstractmethod
+    async def issue(self, db: AsyncSession, email: str, otp_code: str, expires_at: datetime) -> bool:
+        """
+        Stores a new code for ``email``, returns False once ``email`` ran out of attempts.
+
+        Database writes are left to the caller to commit, along with whatever goes with the code.
+        """
+
+    @abstractmethod
+    async def get(self, db: AsyncSession, email: str) -> Otp | RedisOtp | None:
+        ...
+
+    @abstractmethod
+    async def verify(self, db: AsyncSession, otp_obj: Otp | RedisOtp, otp_code: str, now: datetime) -> bool:
+        """
+        Checks ``otp_code`` against the current code of ``otp_obj``.
+
+        Every check counts towards OTP_MAX_VERIFY_ATTEMPTS, past it the code is rejected without
+        being compared. Issuing a new code resets the count.
+        """
+
+    @abstractmethod
+    async def consume(self, db: AsyncSession, otp_obj: Otp | RedisOtp) -> None:
+        """Deletes the verified code, database writes are left to the caller to commit like in issue()."""
+
+
+class SQLOtpStore(OtpStore):
+    async def issue(self, db: AsyncSession, email: str, otp_code: str, expires_at: datetime) -> bool:
+        hashed_values = await hash_otp_code(email, otp_code)
+
+        # A single upsert, the row of an email that ran out of attempts is left as is and not returned.
+        insert = sqlite_insert if db.get_bind().dialect.name == "sqlite" else postgresql_insert
+        stmt = insert(Otp).values(
+            email=email,
+            attempts=1,
+            expires_at=expires_at,
+            **hashed_values
+        ).on_conflict_do_update(
+            index_elements=[Otp.email],
+            set_={**hashed_values, "expires_at": expires_at, "attempts": Otp.attempts + 1, "verify_attempts": 0},
+            where=Otp.attempts < configs.OTP_MAX_ATTEMPTS
+        ).returning(Otp.attempts)
+
+        attempts = (await db.execute(stmt)).scalar_one_or_none()
+        return attempts is not None
+
+    async def get(self, db: AsyncSession, email: str) -> Otp | None:
+        return await get_otp_by_email(db, email)
+
+    async def verify(self, db: AsyncSession, otp_obj: Otp, otp_code: str, now: datetime) -> bool:
+        if otp_obj.expires_at < now:
+            return False
+
+        # The attempt is counted before the code is compared, so concurrent guesses can't overrun the cap.
+        stmt = update(Otp).where(
+            Otp.id == otp_obj.id,
+            Otp.verify_attempts < configs.OTP_MAX_VERIFY_ATTEMPTS
+        ).values(
+            verify_attempts=Otp.verify_attempts + 1
+        ).returning(
+            Otp.email, Otp.code_digest, Otp.hashed_code
+        ).execution_options(synchronize_session=False)
+
+        stored_code = (await db.execute(stmt)).one_or_none()
+        await db.commit()
+        if stored_code is None:
+            return False
+        return await verify_otp_code(stored_code, otp_code)
+
+    async def consume(self, db: AsyncSession, otp_obj: Otp) -> None:
+        await db.delete(otp_obj)
+
+
+class RedisOtpStore(OtpStore):
+    """
+    One hash per email holding the code digest, its expiry, the number of codes issued and the
+    number of times the current code was checked.
+
+    Every operation is a single Lua script. The hash expires OTP_RETENTION after the last code was
+    issued, which is the window OTP_MAX_ATTEMPTS applies to. Codes are always stored as HMAC
+    digests, OTP_HASHING_MODE doesn't apply.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.issue_script = client.register_script(ISSUE_SCRIPT)
+        self.verify_script = client.register_script(VERIFY_SCRIPT)
+        self.consume_script = client.register_script(CONSUME_SCRIPT)
+
+    @staticmethod
+    def _key(email: str) -> str:
+        return f"otp:{email}"
+
+    async def issue(self, db: AsyncSession, email: str, otp_code: str, expires_at: datetime) -> bool:
+        attempts = await self.issue_script(
+            keys=[self._key(email)],
+            args=[
+                otp_digest(email, otp_code),
+                int(expires_at.timestamp()),
+                configs.OTP_MAX_ATTEMPTS,
+                int(configs.OTP_RETENTION.total_seconds())
+            ]
+        )
+        return attempts > 0
+
+    async def get(self, db: AsyncSession, email: str) -> RedisOtp:
+        # Nothing to fetch up front, verify() reads the record.
+        return RedisOtp(email=email)
+
+    async def verify(self, db: AsyncSession, otp_obj: RedisOtp, otp_code: str, now: datetime) -> bool:
+        code_digest = otp_digest(otp_obj.email, otp_code)
+        if not await self.verify_script(
+                keys=[self._key(otp_obj.email)],
+                args=[code_digest, int(now.timestamp()), configs.OTP_MAX_VERIFY_ATTEMPTS]
+        ):
+            return False
+        otp_obj.code_digest = code_digest
+        return True
+
+    async def consume(self, db: AsyncSession, otp_obj: RedisOtp) -> None:
+        # Only deletes the record if it still holds the verified code, not one issued since.
+        if otp_obj.code_digest is not None:
+            await self.consume_script(keys=[self._key(otp_obj.email)], args=[otp_obj.code_digest])
+
+
+def build_otp_store(config: GlobalConfig) -> OtpStore:
+    if config.OTP_BACKEND == "redis":
+        return RedisOtpStore(redis_fastapi)
+    return SQLOtpStore()
+
+
+otp_store = build_otp_store(configs)
@@ -0,0 +1,91 @@
+"""
+Email outbox.
+
+With EMAIL_TRANSPORT=outbox the request path only inserts the message, in the transaction that
+stores the OTP code, and the relay (src.commands.relay_email_outbox) sends it. Relays claim rows
+with SELECT ... FOR UPDATE SKIP LOCKED, so any number of them can drain the table side by side.
+
+Bodies carry OTP codes, which are otherwise only stored as digests, so they are encrypted at rest
+with a key derived from SECRET_KEY.
+"""
+import asyncio
+import base64
+import hashlib
+import hmac
+import logging
+from datetime import datetime, timezone, timedelta
+from functools import lru_cache
+
+from cryptography.fernet import Fernet, InvalidToken
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.core.settings import configs
+from src.infrastructure.email_handler import EmailHandler, retry_delay
+from .models import EmailOutbox
+
+logger = logging.getLogger("app")
+
+
+@lru_cache
+def get_outbox_cipher() -> Fernet:
+    # A dedicated key, like the OTP pepper, so it isn't shared with the JWT signatures.
+    key = hmac.new(configs.SECRET_KEY.encode(), b"fastauth-email-outbox", hashlib.sha256).digest()
+    return Fernet(base64.urlsafe_b64encode(key))
+
+
+def seal_body(body: str) -> str:
+    return get_outbox_cipher().encrypt(body.encode()).decode()
+
+
+def open_body(sealed_body: str) -> str:
+    return get_outbox_cipher().decrypt(sealed_body.encode()).decode()
+
+
+async def relay_email_outbox(db: AsyncSession, handler: EmailHandler, batch_size: int) -> int:
+    """
+    Sends up to ``batch_size`` due messages over one SMTP session and returns how many were claimed.
+
+    Sent messages are deleted, failed ones are retried with backoff until EMAIL_MAX_RETRIES.
+    """
+    now = datetime.now(tz=timezone.utc)
+    messages = (await db.scalars(
+        select(EmailOutbox)
+        .where(EmailOutbox.available_at <= now)
+        .order_by(EmailOutbox.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )).all()
+    if not messages:
+        await db.commit()
+        return 0
+
+    done, sendable = [], []
+    for message in messages:
+        try:
+            sendable.append((message, open_body(message.body)))
+        except InvalidToken:
+            # Sealed with another SECRET_KEY, it can never be sent.
+            logger.error("Dropped undecryptable email to %s", message.recipient)
+            done.append(message.id)
+
+    failed = set()
+    if sendable:
+        failed = set(await asyncio.to_thread(
+            handler.send_emails, [(message.recipient, message.subject, body) for message, body in sendable]
+        ))
+
+    for index, (message, _) in enumerate(sendable):
+        if index not in failed:
+            done.append(message.id)
+        elif message.attempts < configs.EMAIL_MAX_RETRIES:
+            message.available_at = now + timedelta(seconds=retry_delay(message.attempts))
+            message.attempts += 1
+        else:
+            logger.error("Giving up on email to %s after %s attempts", message.recipient, message.attempts + 1)
+            done.append(message.id)
+
+    if done:
+        await db.execute(delete(EmailOutbox).where(EmailOutbox.id.in_(done)))
+    await db.commit()
+    return len(messages)
@@ -0,0 +1,195 @@
+"""
+Refresh token families.
+
+Logging in starts a family. Every refresh token carries its family id (``fam``) and generation
+(``gen``), and the family record keeps the generation of the one token of the family that may still
+be used. Refreshing moves the family to the next generation; presenting an older token means it
+was replayed, and revokes the whole family. The store holds one record per session, expiring
+together with the latest token of the session.
+"""
+import hashlib
+import secrets
+import time
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone, timedelta
+
+from redis.exceptions import RedisError
+from sqlalchemy import insert, update, case
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.apps.users.models import User
+from src.core.settings import configs, GlobalConfig
+from src.infrastructure.redis_pool import redis_fastapi
+from .models import RefreshTokenFamily
+from .tokens import create_jwt_token
+
+REVOKED = -1
+
+# KEYS[1] family, KEYS[2] jti key of the previous store (legacy tokens only)
+# ARGV[1] presented generation, ARGV[2] ttl of the next token, ARGV[3] "1" for legacy tokens
+ROTATE_SCRIPT = """
+local generation = redis.call('GET', KEYS[1])
+if not generation then
+    if ARGV[3] == '0' or redis.call('EXISTS', KEYS[2]) == 1 then
+        return -1
+    end
+    generation = '0'
+end
+generation = tonumber(generation)
+if generation ~= tonumber(ARGV[1]) then
+    if generation >= 0 then
+        redis.call('SET', KEYS[1], -1, 'KEEPTTL')
+    end
+    return -1
+end
+redis.call('SET', KEYS[1], generation + 1, 'EX', ARGV[2])
+return generation + 1
+"""
+
+
+def _ttl(expires_at: int) -> int:
+    return max(int(expires_at - time.time()), 1)
+
+
+class RefreshTokenFamilyStore(ABC):
+    @abstractmethod
+    async def start(self, db: AsyncSession, family: str, expires_at: int) -> None:
+        ...
+
+    @abstractmethod
+    async def rotate(
+            self, db: AsyncSession, family: str, generation: int, expires_at: int, legacy_jti: str | None = None
+    ) -> bool:
+        """
+        Moves ``family`` from ``generation`` to the next one and returns True.
+
+        Returns False if the family is unknown or revoked, and revokes it if ``generation`` is stale.
+        ``legacy_jti`` is set for tokens issued before families, which start theirs on first use.
+        """
+
+
+class SQLRefreshTokenFamilyStore(RefreshTokenFamilyStore):
+    async def start(self, db: AsyncSession, family: str, expires_at: int) -> None:
+        await db.execute(
+            insert(RefreshTokenFamily).values(
+                family_id=family,
+                generation=0,
+                expires_at=datetime.fromtimestamp(expires_at, tz=timezone.utc)
+            )
+        )
+        await db.commit()
+
+    async def rotate(
+            self, db: AsyncSession, family: str, generation: int, expires_at: int, legacy_jti: str | None = None
+    ) -> bool:
+        if legacy_jti is not None:
+            return await self._rotate_legacy(db, family, expires_at)
+
+        # One statement both advances a current family and revokes a replayed one.
+        is_current = RefreshTokenFamily.generation == generation
+        stmt = update(RefreshTokenFamily).where(
+            RefreshTokenFamily.family_id == family,
+            RefreshTokenFamily.generation != REVOKED
+        ).values(
+            generation=case((is_current, generation + 1), else_=REVOKED),
+            expires_at=case(
+                (is_current, datetime.fromtimestamp(expires_at, tz=timezone.utc)),
+                else_=RefreshTokenFamily.expires_at
+            )
+        ).returning(RefreshTokenFamily.generation).execution_options(synchronize_session=False)
+
+        new_generation = (await db.execute(stmt)).scalar_one_or_none()
+        await db.commit()
+        return new_generation == generation + 1
+
+    async def _rotate_legacy(self, db: AsyncSession, family: str, expires_at: int) -> bool:
+        try:
+            await db.execute(
+                insert(RefreshTokenFamily).values(
+                    family_id=family,
+                    generation=1,
+                    expires_at=datetime.fromtimestamp(expires_at, tz=timezone.utc)
+                )
+            )
+            await db.commit()
+        except IntegrityError:
+            await db.rollback()
+            await db.execute(
+                update(RefreshTokenFamily).where(RefreshTokenFamily.family_id == family).values(generation=REVOKED)
+            )
+            await db.commit()
+            return False
+        return True
+
+
+class RedisRefreshTokenFamilyStore(RefreshTokenFamilyStore):
+    """
+    One key per family holding its generation, rotated by a Lua script.
+
+    Falls back to ``fallback`` while Redis is unreachable. Families only one of the stores knows
+    about are rejected, so the sessions affected by an outage have to log in again.
+    """
+
+    def __init__(self, client, fallback: RefreshTokenFamilyStore):
+        self.client = client
+        self.fallback = fallback
+        self.rotate_script = client.register_script(ROTATE_SCRIPT)
+
+    async def start(self, db: AsyncSession, family: str, expires_at: int) -> None:
+        try:
+            await self.client.set(f"refresh_family:{family}", 0, ex=_ttl(expires_at))
+        except RedisError:
+            await self.fallback.start(db, family, expires_at)
+
+    async def rotate(
+            self, db: AsyncSession, family: str, generation: int, expires_at: int, legacy_jti: str | None = None
+    ) -> bool:
+        keys = [f"refresh_family:{family}"]
+        if legacy_jti is not None:
+            keys.append(f"refresh_token:{legacy_jti}")
+
+        try:
+            new_generation = await self.rotate_script(
+                keys=keys,
+                args=[generation, _ttl(expires_at), int(legacy_jti is not None)]
+            )
+        except RedisError:
+            return await self.fallback.rotate(db, family, generation, expires_at, legacy_jti)
+        return new_generation == generation + 1
+
+
+def build_refresh_token_family_store(config: GlobalConfig) -> RefreshTokenFamilyStore:
+    if config.REFRESH_TOKEN_STORE == "sql":
+        return SQLRefreshTokenFamilyStore()
+    return RedisRefreshTokenFamilyStore(redis_fastapi, fallback=SQLRefreshTokenFamilyStore())
+
+
+refresh_token_families = build_refresh_token_family_store(configs)
+
+
+async def issue_refresh_token(db: AsyncSession, user: User, expires_at: timedelta) -> str:
+    family = secrets.token_urlsafe(16)
+    # Minted before the store commits, committing expires the attributes of ``user``.
+    token = create_jwt_token(user, "refresh", expires_at, family=family)
+    await refresh_token_families.start(db, family, int(time.time() + expires_at.total_seconds()))
+    return token
+
+
+async def rotate_refresh_token(
+        db: AsyncSession, user: User, token: str, claims: dict, expires_at: timedelta
+) -> str | None:
+    """Returns the successor of the refresh token ``token``, or None if it can't be used anymore."""
+    if "fam" in claims:
+        family, generation, legacy_jti = claims["fam"], claims["gen"], None
+    else:
+        # Issued before families existed, identified the way the previous jti store did.
+        legacy_jti = claims.get("jti") or hashlib.sha256(token.encode()).hexdigest()
+        family, generation = hashlib.sha256(legacy_jti.encode()).hexdigest(), 0
+
+    new_token = create_jwt_token(user, "refresh", expires_at, family=family, generation=generation + 1)
+    if not await refresh_token_families.rotate(
+            db, family, generation, int(time.time() + expires_at.total_seconds()), legacy_jti
+    ):
+        return None
+    return new_token
@@ -16,12 +16,14 @@ async def get_active_blacklist_by_email(db: AsyncSession, email: str, current_ti
                     (OtpBlacklist.expires_at.is_(None))
             )
         )
+        .execution_options(read_from_primary=True)
     )
     result = await db.execute(stmt)
     return result.scalar_one_or_none()
 
 
 async def get_otp_by_email(db: AsyncSession, email: str) -> Otp | None:
-    stmt = select(Otp).where(Otp.email == email)
+    # Codes are checked right after they are issued, before a replica may have them.
+    stmt = select(Otp).where(Otp.email == email).execution_options(read_from_primary=True)
     result = await db.execute(stmt)
     return result.scalar_one_or_none()
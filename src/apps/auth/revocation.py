@@ -0,0 +1,123 @@
+"""
+Per-worker filter of revoked token versions.
+
+Revoking the tokens of a user bumps ``users.token_version``; every access token carrying an older
+version is revoked. Each worker keeps the revoked ``<user id>:<version>`` pairs in a Bloom filter,
+rebuilt from the database (and the token version cache, for deleted users) when it subscribes to
+the revocation channel and updated from the channel afterwards. Only tokens the filter reports as
+possibly revoked are checked against the token version store.
+"""
+import asyncio
+import logging
+
+from redis.exceptions import RedisError
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.apps.users.models import User
+from src.core.bloom import BloomFilter
+from src.core.metrics import metrics, MetricsRegistry
+from src.core.settings import configs
+
+logger = logging.getLogger("app")
+
+REVOCATION_CHANNEL = "token_revocations"
+RESUBSCRIBE_DELAY = 5
+
+
+def _add_revoked_versions(bloom: BloomFilter, user_id: int, version: int) -> None:
+    for revoked_version in range(version):
+        bloom.add(f"{user_id}:{revoked_version}")
+
+
+class RevocationFilter:
+    """
+    A miss means the token version is not revoked. Until the filter is loaded and subscribed, and
+    whenever the subscription drops, every token is reported as possibly revoked.
+    """
+
+    def __init__(self, capacity: int, error_rate: float, registry: MetricsRegistry = metrics):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bloom = BloomFilter(capacity, error_rate)
+        self.ready = False
+
+        registry.gauge(
+            "revocation_filter_items", "Revoked token versions in the filter.", lambda: len(self.bloom)
+        )
+        registry.gauge(
+            "revocation_filter_ready", "Whether the revocation filter is in sync.", lambda: int(self.ready)
+        )
+        self.skipped_lookups = registry.counter(
+            "revocation_filter_skipped_lookups_total", "Token version lookups answered by the filter alone."
+        )
+
+    def might_be_revoked(self, user_id: int, version: int) -> bool:
+        if self.ready and f"{user_id}:{version}" not in self.bloom:
+            self.skipped_lookups.inc()
+            return False
+        return True
+
+    def add(self, user_id: int, version: int) -> None:
+        """Marks every version of ``user_id`` older than ``version`` as revoked."""
+        _add_revoked_versions(self.bloom, user_id, version)
+
+    async def rebuild(self, db: AsyncSession, client) -> None:
+        bloom = BloomFilter(self.capacity, self.error_rate)
+
+        result = await db.stream(
+            select(User.id, User.token_version)
+            .where(User.token_version > 0)
+            .execution_options(read_from_primary=True)
+        )
+        async for user_id, version in result:
+            _add_revoked_versions(bloom, user_id, version)
+
+        # Deleted users are gone from the table, their latest version outlives them in the cache.
+        keys = [key async for key in client.scan_iter(match="user:*:token_version", count=1000)]
+        for start in range(0, len(keys), 1000):
+            batch = keys[start:start + 1000]
+            for key, version in zip(batch, await client.mget(batch)):
+                if version is not None:
+                    _add_revoked_versions(bloom, int(key.split(b":")[1]), int(version))
+
+        self.bloom = bloom
+
+    async def publish(self, client, user_id: int, version: int) -> None:
+        """Revokes the older versions here and on every other worker, raises if the others can't be told."""
+        self.add(user_id, version)
+        try:
+            await client.publish(REVOCATION_CHANNEL, f"{user_id}:{version}")
+        except RedisError:
+            logger.error("Could not publish the revocation of user %s tokens before version %s", user_id, version)
+            raise
+
+    async def run(self, client, session_factory) -> None:
+        """
+        Keeps the filter in sync until cancelled, meant to run for the lifetime of the worker.
+
+        The subscription holds a connection of ``client`` the whole time, give it a client of its own.
+        """
+        while True:
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            try:
+                # Subscribe before loading, revocations published during the load wait in the subscription.
+                await pubsub.subscribe(REVOCATION_CHANNEL)
+                async with session_factory() as db:
+                    await self.rebuild(db, client)
+                self.ready = True
+
+                async for message in pubsub.listen():
+                    user_id, version = message["data"].split(b":")
+                    self.add(int(user_id), int(version))
+            except (RedisError, SQLAlchemyError, OSError, ValueError):
+                pass
+            finally:
+                self.ready = False
+                await pubsub.reset()
+
+            await asyncio.sleep(RESUBSCRIBE_DELAY)
+
+
+revocation_filter = RevocationFilter(configs.REVOCATION_FILTER_CAPACITY, configs.REVOCATION_FILTER_ERROR_RATE)
@@ -6,13 +6,13 @@ from fastapi import APIRouter, status, HTTPException, Response, Request, Cookie
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 
 from src.apps.users.repository import user_exists_with_email_or_username, get_user_by_email
-from src.apps.utils import get_or_create, auth_responses
+from src.apps.utils import auth_responses
 from src.core.limiter import limiter
 from src.core.schemas import DataSchema, ErrorResponse
 from src.core.settings import configs
 from src.dependencies import db_dependency
-from .models import RefreshTokenBlacklist
-from .repository import get_otp_by_email
+from .keys import key_ring
+from .refresh_tokens import issue_refresh_token, rotate_refresh_token
 from .schemas import (
     UserRegisterRequest,
     UserOTPResponse,
@@ -24,22 +24,27 @@ from .schemas import (
 from .services import (
     check_blacklist_for_user,
     check_email_exists,
+    get_otp_by_email,
     is_otp_valid,
     register_user,
     delete_otp,
-    create_jwt_token,
     authenticate_user,
-    get_authenticated_user,
-    decode_refresh_token,
+    get_user_or_401,
     generate_and_send_otp,
     oauth
 )
+from .tokens import create_jwt_token, decode_refresh_token
 
 router = APIRouter(
     prefix="/auth",
     tags=["auth"]
 )
 
+well_known_router = APIRouter(
+    prefix="/.well-known",
+    tags=["auth"]
+)
+
 
 @router.post(
     "/register",
@@ -118,12 +123,14 @@ async def verify_otp_code(
     email = str(request_data.email)
     otp_obj = await get_otp_by_email(db, email)
 
-    if not is_otp_valid(otp_code, otp_obj):
+    if not await is_otp_valid(db, otp_code, otp_obj):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid or expired OTP code.")
 
     if await user_exists_with_email_or_username(db, email, request_data.username):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Username or email already taken.")
 
+    # Committed along with the new user.
+    await delete_otp(db, otp_obj)
     try:
         user = await register_user(
             db,
@@ -134,9 +141,6 @@ async def verify_otp_code(
     except (IntegrityError, SQLAlchemyError):
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Internal server error.")
 
-    await delete_otp(db, otp_obj)
-    await db.refresh(user)
-
     return {
         "data": {
             "message": "User Registered successfully.",
@@ -172,7 +176,8 @@ async def user_login(
             detail="Email or password incorrect. if you believe your account is deactivated, call support."
         )
 
-    refresh_token = create_jwt_token(user.id, email, "refresh", timedelta(hours=24))
+    access_token = create_jwt_token(user, "access")
+    refresh_token = await issue_refresh_token(db, user, timedelta(hours=24))
     response.set_cookie(
         key="refresh_token",
         value=refresh_token,
@@ -183,7 +188,6 @@ async def user_login(
         samesite="lax"
     )
 
-    access_token = create_jwt_token(user.id, email, "access")
     return {"data": {"message": "User logged in Successfully.", "access_token": access_token}}
 
 
@@ -203,29 +207,27 @@ async def user_login(
 async def refresh_auth_token(
         db: db_dependency, refresh_token: Annotated[str, Cookie()], response: Response, request: Request
 ):
-    user_id = decode_refresh_token(refresh_token)
-    user = await get_authenticated_user(db, user_id)
+    claims = decode_refresh_token(refresh_token)
+    user = await get_user_or_401(db, int(claims["sub"]))
 
     if user is None:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid refresh token.")
 
-    if not user.is_active:
+    # Refresh tokens issued before token versions existed carry no "ver" claim.
+    if not user.is_active or claims.get("ver", 0) != user.token_version:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid refresh token."
         )
 
-    user_id = user.id
-    user_email = user.email
-
-    _, is_new = await get_or_create(db, RefreshTokenBlacklist, refresh=refresh_token)
-    if not is_new:
+    access_token = create_jwt_token(user, "access")
+    new_refresh_token = await rotate_refresh_token(db, user, refresh_token, claims, timedelta(hours=24))
+    if new_refresh_token is None:
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Blocked refresh token.")
 
-    refresh_token = create_jwt_token(user_id, user_email, "refresh", timedelta(hours=24))
     response.set_cookie(
         key="refresh_token",
-        value=refresh_token,
+        value=new_refresh_token,
         httponly=True,
         secure=(not configs.DEBUG),
         path="/auth/refresh",
@@ -233,7 +235,6 @@ async def refresh_auth_token(
         samesite="lax"
     )
 
-    access_token = create_jwt_token(user_id, user_email, "access")
     return {"data": {"message": "Token Refreshed successfully.", "access_token": access_token}}
 
 
@@ -280,7 +281,8 @@ async def auth_by_google(db: db_dependency, request: Request, response: Response
             username=username
         )
 
-    refresh_token = create_jwt_token(user.id, email, "refresh", timedelta(hours=24))
+    access_token = create_jwt_token(user, "access")
+    refresh_token = await issue_refresh_token(db, user, timedelta(hours=24))
     response.set_cookie(
         key="refresh_token",
         value=refresh_token,
@@ -291,5 +293,13 @@ async def auth_by_google(db: db_dependency, request: Request, response: Response
         samesite="lax"
     )
 
-    access_token = create_jwt_token(user.id, email, "access")
     return {"data": {"message": "User logged in Successfully.", "access_token": access_token}}
+
+
+@well_known_router.get(
+    "/jwks.json",
+    status_code=status.HTTP_200_OK,
+)
+async def get_jwks(response: Response):
+    response.headers["Cache-Control"] = f"public, max-age={configs.JWKS_CACHE_MAX_AGE}"
+    return key_ring.jwks()
@@ -2,6 +2,7 @@ from typing import Self
 
 from pydantic import BaseModel, EmailStr, Field, model_validator
 
+from src.apps.users.models import UserRoles
 from src.apps.users.schemas import UserOut
 from .validators import PasswordValidator
 
@@ -46,3 +47,10 @@ class UserTokenResponse(BaseModel):
 
 class RefreshTokenRequest(BaseModel):
     refresh_token: str
+
+
+class TokenPrincipal(BaseModel):
+    id: int
+    role: UserRoles
+    is_active: bool
+    token_version: int
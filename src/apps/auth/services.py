@@ -1,47 +1,53 @@
-from datetime import datetime, timedelta
+import logging
+import time
+from datetime import datetime
 from random import randint
-from typing import Literal, Annotated
+from typing import Annotated
 
 import pytz
-from argon2 import PasswordHasher
-from argon2.exceptions import VerifyMismatchError
 from authlib.integrations.starlette_client import OAuth
 from fastapi import Depends, status
 from fastapi import Request, HTTPException
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from jose import jwt, JWTError
-from sqlalchemy import update
+from redis.exceptions import RedisError
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.apps.tasks import send_otp_code_email
+from src.apps.email_batcher import otp_email_batcher
+from src.apps.tasks import send_otp_code_email, otp_code_email
 from src.apps.users.models import User, UserRoles
-from src.apps.users.repository import get_user_by_email, create_user, get_user_by_id
+from src.apps.users.repository import get_user_by_email, create_user, get_user_by_id, get_user_token_version
 from src.apps.utils import get_or_create
+from src.core.hashing import check_needs_rehash
 from src.core.settings import configs
 from src.dependencies import db_dependency
-from .models import Otp, OtpBlacklist
+from src.infrastructure.database import current_read_routing, replica_set
+from src.infrastructure.email_transport import email_transport
+from src.infrastructure.redis_pool import redis_fastapi
+from .models import Otp, OtpBlacklist, EmailOutbox
+from .otp import otp_store, RedisOtp
+from .outbox import seal_body
 from .repository import get_active_blacklist_by_email
+from .revocation import revocation_filter
+from .schemas import TokenPrincipal
+from .tokens import decode_access_token
 
-hasher = PasswordHasher()
+logger = logging.getLogger("app")
 
 
 class JWTBearer(HTTPBearer):
     def __init__(self, auto_error: bool = True):
         super(JWTBearer, self).__init__(auto_error=auto_error)
 
-    async def __call__(self, request: Request):
+    async def __call__(self, request: Request) -> dict:
         credentials: HTTPAuthorizationCredentials = await super(JWTBearer, self).__call__(request)
         if credentials:
             if not credentials.scheme == "Bearer":
                 raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid authentication scheme.")
 
-            try:
-                decode_access_token(credentials.credentials)
-            except JWTError as e:
-                raise e
-
-            return credentials.credentials
+            claims = decode_access_token(credentials.credentials)
+            request.state.token_claims = claims
+            return claims
         else:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -71,18 +77,46 @@ oauth.register(
 )
 
 
+def _blacklist_cache_key(email: str) -> str:
+    return f"otp_blacklist:{email}"
+
+
 async def check_blacklist_for_user(db: AsyncSession, email: str) -> str | None:
+    """
+    Returns the message to reject a blacklisted email with, or None.
+
+    The result is cached in Redis: blocks until they expire (capped at OTP_BLACKLIST_CACHE_TTL),
+    the absence of one for OTP_BLACKLIST_NEGATIVE_CACHE_TTL.
+    """
+    key = _blacklist_cache_key(email)
+    try:
+        cached = await redis_fastapi.get(key)
+    except RedisError:
+        cached = None
+
+    if cached is not None:
+        return cached.decode() or None
+
     now = datetime.now(tz=pytz.timezone(configs.TIMEZONE))
 
     blacklist = await get_active_blacklist_by_email(db, email, now)
     response: str | None = None
+    ttl = configs.OTP_BLACKLIST_NEGATIVE_CACHE_TTL
 
     if blacklist and blacklist.expires_at is not None:
         expiration_date_time = blacklist.expires_at.strftime("%Y-%m-%d %H:%M:%S")
         response = f"You have been blocked until {expiration_date_time}"
+        ttl = min(int(blacklist.expires_at.timestamp() - time.time()), configs.OTP_BLACKLIST_CACHE_TTL)
 
     if blacklist and blacklist.expires_at is None:
         response = "You have been permanently blocked. if you believe this is a mistake, please contact support."
+        ttl = configs.OTP_BLACKLIST_CACHE_TTL
+
+    if ttl > 0:
+        try:
+            await redis_fastapi.set(key, response or "", ex=ttl)
+        except RedisError:
+            pass
 
     return response
 
@@ -92,59 +126,53 @@ async def check_email_exists(db: AsyncSession, email: str) -> bool:
     return user is not None
 
 
-async def generate_otp(db: AsyncSession, email: str) -> (Otp, str, str, bool, datetime):
+async def generate_otp(db: AsyncSession, email: str) -> (str, bool):
     expires_at = datetime.now(tz=pytz.timezone(configs.TIMEZONE)) + configs.OTP_EXPIRATION_TIME
 
     otp_code = str(randint(100_000, 999_999))
-    hashed_code = hasher.hash(otp_code)
+    issued = await otp_store.issue(db, email, otp_code, expires_at)
 
-    obj, is_new = await get_or_create(
-        db,
-        Otp,
-        {"hashed_code": hashed_code, "expires_at": expires_at},
-        email=email
-    )
-
-    return obj, otp_code, hashed_code, is_new, expires_at
-
-
-async def refresh_otp_code(db: AsyncSession, otp: Otp, hashed_otp: str, expires_at: datetime):
-    stmt = update(Otp).where(Otp.id == otp.id).values(
-        hashed_code=hashed_otp,
-        expires_at=expires_at,
-        attempts=Otp.attempts + 1
-    )
-    await db.execute(stmt)
-    await db.commit()
-    await db.refresh(otp)
+    return otp_code, issued
 
 
 async def generate_and_send_otp(db: AsyncSession, email: str):
-    otp_obj, otp_code, hashed_code, is_new, expires_at = await generate_otp(db, email)
+    otp_code, issued = await generate_otp(db, email)
 
-    if not is_new and otp_obj.attempts >= configs.OTP_MAX_ATTEMPTS:
+    if not issued:
         await get_or_create(db, OtpBlacklist, email=email)
+        try:
+            await redis_fastapi.delete(_blacklist_cache_key(email))
+        except RedisError:
+            pass
         message = "Too many requests. Your email has been added to the blacklist."
         raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=message)
 
-    if not is_new:
-        await refresh_otp_code(db, otp_obj, hashed_code, expires_at)
+    if configs.EMAIL_TRANSPORT == "outbox":
+        # Committed together with the code, the outbox relay sends it.
+        recipient, subject, body = otp_code_email(email, otp_code)
+        db.add(EmailOutbox(recipient=recipient, subject=subject, body=seal_body(body)))
+    await db.commit()
+
+    if configs.EMAIL_TRANSPORT == "async":
+        email_transport.send(*otp_code_email(email, otp_code))
+    elif configs.EMAIL_TRANSPORT == "celery":
+        if configs.EMAIL_BATCHING:
+            otp_email_batcher.add(email, otp_code)
+        else:
+            send_otp_code_email.delay(email, otp_code)
 
-    send_otp_code_email.delay(email, otp_code)
 
+async def get_otp_by_email(db: AsyncSession, email: str) -> Otp | RedisOtp | None:
+    return await otp_store.get(db, email)
 
-def is_otp_valid(otp_code: str, otp_obj: Otp) -> bool:
-    now = datetime.now(tz=pytz.timezone(configs.TIMEZONE))
 
-    if otp_obj is None or otp_obj.expires_at < now:
-        return False
+async def is_otp_valid(db: AsyncSession, otp_code: str, otp_obj: Otp | RedisOtp | None) -> bool:
+    now = datetime.now(tz=pytz.timezone(configs.TIMEZONE))
 
-    try:
-        hasher.verify(otp_obj.hashed_code, otp_code)
-    except VerifyMismatchError:
+    if otp_obj is None:
         return False
 
-    return True
+    return await otp_store.verify(db, otp_obj, otp_code, now)
 
 
 async def authenticate_user(db: AsyncSession, email: str, password: str) -> User | None:
@@ -156,22 +184,21 @@ async def authenticate_user(db: AsyncSession, email: str, password: str) -> User
     if not user.is_active:
         return None
 
-    if not user.verify_password(password):
+    if not await user.verify_password_async(password):
         return None
 
-    return user
-
+    if check_needs_rehash(user.password):
+        await user.set_password_async(password)
+        user_id = user.id
+        try:
+            await db.commit()
+        except SQLAlchemyError:
+            await db.rollback()
+            logger.warning("Could not store the rehashed password of user %s", user_id, exc_info=True)
+            # The rollback expired the user, the login goes on with the stored (old) hash.
+            await db.refresh(user)
 
-def create_jwt_token(
-        user_id: int,
-        email: str,
-        token_type: Literal["access", "refresh"],
-        expires_at: timedelta = timedelta(minutes=15)
-) -> str:
-    payload = {"user_id": user_id, "email": email, "token_type": token_type}
-    exp = datetime.now(tz=pytz.timezone(configs.TIMEZONE)) + expires_at
-    payload.update({"exp": exp})
-    return jwt.encode(payload, configs.SECRET_KEY, algorithm="HS256")
+    return user
 
 
 async def register_user(db: AsyncSession, email: str, username: str, password: str | None = None) -> User:
@@ -180,7 +207,7 @@ async def register_user(db: AsyncSession, email: str, username: str, password: s
     if password is None:
         user.set_unusable_password()
     elif password is not None:
-        user.set_password(password)
+        await user.set_password_async(password)
 
     try:
         user = await create_user(db, user)
@@ -190,91 +217,157 @@ async def register_user(db: AsyncSession, email: str, username: str, password: s
     except SQLAlchemyError as e:
         await db.rollback()
         raise RuntimeError(f"Database error: {e}")
+    attribute_reads_to(user.id)
     return user
 
 
-async def delete_otp(db: AsyncSession, otp: Otp):
-    await db.delete(otp)
-    await db.commit()
+async def delete_otp(db: AsyncSession, otp: Otp | RedisOtp):
+    await otp_store.consume(db, otp)
+
+
+async def get_user_or_401(db: AsyncSession, user_id: int) -> User:
+    user = await get_user_by_id(db, user_id)
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Authentication failed, invalid user.",
+        )
+    return user
+
+
+def _token_version_key(user_id: int) -> str:
+    return f"user:{user_id}:token_version"
 
 
-def decode_access_token(token: Annotated[str, Depends(oauth_schema)]):
+# Only ever raises the cached version, so an announcement can't be overwritten by an older one.
+RAISE_TOKEN_VERSION_SCRIPT = """
+local current = tonumber(redis.call("GET", KEYS[1]))
+if current == nil or current < tonumber(ARGV[1]) then
+    redis.call("SET", KEYS[1], ARGV[1], "EX", ARGV[2])
+end
+"""
+
+raise_token_version = redis_fastapi.register_script(RAISE_TOKEN_VERSION_SCRIPT)
+
+
+async def cache_token_version(user_id: int, version: int):
+    """Caches a version read from the database, unless a (newer) version was announced meanwhile."""
     try:
-        payload = jwt.decode(token, configs.SECRET_KEY, algorithms=["HS256"])
-        user_id: int = payload.get("user_id")
-        token_type: str = payload.get("token_type")
+        await redis_fastapi.set(_token_version_key(user_id), version, ex=configs.TOKEN_VERSION_CACHE_TTL, nx=True)
+    except RedisError:
+        pass
 
-        if user_id is None:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Authentication failed, Invalid token.",
-            )
 
-        if token_type != "access":
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Authentication failed, invalid token type."
-            )
+async def announce_token_version(user_id: int, version: int):
+    """
+    Publishes the token version of a user after it changed, revoking the tokens of older versions.
+
+    If the new version can't be cached, the cached one is dropped so the next lookup reads the table;
+    when that fails too the error is raised, an outdated version must not stay cached.
+    """
+    key = _token_version_key(user_id)
+    try:
+        await raise_token_version(keys=[key], args=[version, configs.TOKEN_VERSION_CACHE_TTL])
+    except RedisError:
+        await redis_fastapi.delete(key)
+    await revocation_filter.publish(redis_fastapi, user_id, version)
+
+
+def _recent_write_key(user_id: int) -> str:
+    return f"user:{user_id}:recent_write"
 
-    except JWTError:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Authentication failed, invalid or expired token.",
-        )
 
-    return user_id
+def attribute_reads_to(user_id: int) -> None:
+    """Records the user the current request acts for, their writes make their reads stick to the primary."""
+    routing = current_read_routing()
+    if routing is not None:
+        routing.user_id = user_id
 
 
-def decode_refresh_token(token: str):
+async def remember_recent_write(user_id: int):
+    """Sends the reads of ``user_id`` to the primary for DATABASE_REPLICA_STICKY_SECONDS."""
     try:
-        payload = jwt.decode(token, configs.SECRET_KEY, algorithms=["HS256"])
-        user_id: int = payload.get("user_id")
-        token_type: str = payload.get("token_type")
+        await redis_fastapi.set(_recent_write_key(user_id), 1, ex=configs.DATABASE_REPLICA_STICKY_SECONDS)
+    except RedisError:
+        logger.warning("Could not pin the reads of user %s to the primary", user_id)
 
-        if user_id is None:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Authentication failed, Invalid token.",
-            )
 
-        if token_type != "refresh":
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Authentication failed, invalid token type."
-            )
+async def route_user_reads(user_id: int):
+    attribute_reads_to(user_id)
+    routing = current_read_routing()
+    if routing is None or routing.primary or not replica_set:
+        return
+    try:
+        routing.primary = bool(await redis_fastapi.exists(_recent_write_key(user_id)))
+    except RedisError:
+        routing.primary = True
 
-    except JWTError:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Authentication failed, invalid or expired token.",
-        )
 
-    return user_id
+async def get_token_version(db: AsyncSession, user_id: int) -> int | None:
+    """
+    Returns the current token version of a user, or None if the user doesn't exist.
 
+    The version lives in the users table and is cached in Redis, so the common case is a single GET.
+    """
+    try:
+        version = await redis_fastapi.get(_token_version_key(user_id))
+    except RedisError:
+        version = None
 
-async def get_authenticated_user(db: db_dependency, user_id: Annotated[int, Depends(decode_access_token)]):
-    user = await get_user_by_id(db, user_id)
-    if user is None:
+    if version is not None:
+        return int(version)
+
+    version = await get_user_token_version(db, user_id)
+    if version is not None:
+        await cache_token_version(user_id, version)
+    return version
+
+
+async def get_token_principal(db: db_dependency, claims: Annotated[dict, Depends(oauth_schema)]) -> TokenPrincipal:
+    principal = TokenPrincipal(
+        id=int(claims["sub"]),
+        role=claims["rol"],
+        is_active=claims["act"],
+        token_version=claims["ver"]
+    )
+    await route_user_reads(principal.id)
+
+    if not revocation_filter.might_be_revoked(principal.id, principal.token_version):
+        return principal
+
+    current_version = await get_token_version(db, principal.id)
+    if current_version is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Authentication failed, invalid user.",
         )
-    return user
+
+    if current_version != principal.token_version:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Authentication failed, token has been revoked.",
+        )
+
+    return principal
 
 
-async def get_admin_user(user: Annotated[User, Depends(get_authenticated_user)]):
-    if user.role.value != UserRoles.admin.value:
+async def get_admin_user(principal: Annotated[TokenPrincipal, Depends(get_token_principal)]):
+    if principal.role != UserRoles.admin:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You do not have access to this resource",
         )
-    return user
+    return principal
 
 
-async def get_active_user(user: Annotated[User, Depends(get_authenticated_user)]):
-    if not user.is_active:
+async def get_active_principal(principal: Annotated[TokenPrincipal, Depends(get_token_principal)]):
+    if not principal.is_active:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Inactive account.",
         )
-    return user
+    return principal
+
+
+async def get_active_user(db: db_dependency, principal: Annotated[TokenPrincipal, Depends(get_active_principal)]):
+    return await get_user_or_401(db, principal.id)
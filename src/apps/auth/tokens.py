@@ -0,0 +1,240 @@
+"""
+JWT minting and verification.
+
+Tokens carry compact claims only:
+
+* ``sub`` user id (string, as required by RFC 7519)
+* ``typ`` ``access`` or ``refresh``
+* ``ver`` token version of the user when the token was issued
+* ``exp`` expiry as integer epoch seconds
+* ``rol`` / ``act`` role and active flag, access tokens only
+* ``fam`` / ``gen`` family id and generation, refresh tokens only (see refresh_tokens.py)
+"""
+import base64
+import hashlib
+import hmac
+import json
+import time
+from datetime import timedelta
+from typing import Literal
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+from fastapi import HTTPException, status
+
+from src.apps.users.models import User, UserRoles
+from src.core.cache import TTLCache
+from src.core.settings import configs, GlobalConfig
+from .keys import key_ring, KeyRing, InvalidTokenError
+
+
+ACCESS_TOKEN_CLAIMS = ("sub", "typ", "ver", "rol", "act", "exp")
+
+verified_access_tokens = TTLCache(maxsize=configs.ACCESS_TOKEN_CACHE_SIZE)
+rejected_access_tokens = TTLCache(maxsize=configs.ACCESS_TOKEN_NEGATIVE_CACHE_SIZE)
+
+
+def _b64encode(data: bytes) -> bytes:
+    return base64.urlsafe_b64encode(data).rstrip(b"=")
+
+
+def _b64decode(data: bytes) -> bytes:
+    return base64.urlsafe_b64decode(data + b"=" * (-len(data) % 4))
+
+
+def _json_dumps(data: dict) -> bytes:
+    # Same serialization as Authlib, so both backends produce identical tokens.
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+class NativeKey:
+    """A key ring entry with its cryptography key objects and encoded JWS header prepared up front."""
+
+    def __init__(self, key, algorithm: str):
+        self.algorithm = algorithm
+        self.kid = None if algorithm == "HS256" else key.kid
+
+        header = {"alg": algorithm, "typ": "JWT"}
+        if self.kid is not None:
+            header["kid"] = self.kid
+        self.header_segment = _b64encode(_json_dumps(header))
+
+        if algorithm == "HS256":
+            self.secret = key.get_op_key("sign")
+        else:
+            self.private_key = key.get_private_key()
+            self.public_key = key.get_public_key()
+
+    def sign(self, message: bytes) -> bytes:
+        if self.algorithm == "HS256":
+            return hmac.new(self.secret, message, hashlib.sha256).digest()
+        if self.algorithm == "RS256":
+            return self.private_key.sign(message, padding.PKCS1v15(), hashes.SHA256())
+        return self.private_key.sign(message)
+
+    def verify(self, message: bytes, signature: bytes) -> bool:
+        if self.algorithm == "HS256":
+            return hmac.compare_digest(self.sign(message), signature)
+        try:
+            if self.algorithm == "RS256":
+                self.public_key.verify(signature, message, padding.PKCS1v15(), hashes.SHA256())
+            else:
+                self.public_key.verify(signature, message)
+        except InvalidSignature:
+            return False
+        return True
+
+
+class NativeBackend:
+    """
+    Compact JWS encoder/decoder working directly on the key ring's cryptography keys.
+
+    Skips Authlib's generic header and claims machinery: headers produced by this service are
+    matched byte for byte to their key, and only ``exp`` is validated. Tokens are interchangeable
+    with the Authlib backend.
+    """
+
+    def __init__(self, key_ring: KeyRing):
+        self.algorithm = key_ring.algorithm
+        self.keys = [NativeKey(key, key_ring.algorithm) for key in key_ring.keys]
+        self.signing_key = self.keys[0]
+        self.keys_by_header = {key.header_segment: key for key in self.keys}
+
+    def encode(self, payload: dict) -> str:
+        signing_input = self.signing_key.header_segment + b"." + _b64encode(_json_dumps(payload))
+        return (signing_input + b"." + _b64encode(self.signing_key.sign(signing_input))).decode()
+
+    def decode(self, token: str) -> dict:
+        try:
+            signing_input, _, signature = token.encode("ascii").rpartition(b".")
+            header_segment, _, payload_segment = signing_input.partition(b".")
+            key = self.keys_by_header.get(header_segment) or self._find_key(header_segment)
+
+            if not key.verify(signing_input, _b64decode(signature)):
+                raise InvalidTokenError("Invalid signature.")
+            payload = json.loads(_b64decode(payload_segment))
+        except (ValueError, TypeError, AttributeError) as e:
+            raise InvalidTokenError(f"Malformed token: {e}") from e
+
+        if not isinstance(payload, dict) or not isinstance(payload.get("exp"), int):
+            raise InvalidTokenError("Missing or invalid exp claim.")
+        if payload["exp"] < time.time():
+            raise InvalidTokenError("Token has expired.")
+        return payload
+
+    def _find_key(self, header_segment: bytes) -> NativeKey:
+        # Headers written by another encoder (different member order, extra members) end up here.
+        header = json.loads(_b64decode(header_segment))
+        if header.get("alg") != self.algorithm:
+            raise InvalidTokenError("Unexpected signing algorithm.")
+        for key in self.keys:
+            if key.kid == header.get("kid"):
+                return key
+        raise InvalidTokenError("Unknown signing key.")
+
+
+def load_token_backend(config: GlobalConfig, key_ring: KeyRing) -> KeyRing | NativeBackend:
+    if config.JWT_BACKEND == "native":
+        return NativeBackend(key_ring)
+    return key_ring
+
+
+token_backend = load_token_backend(configs, key_ring)
+
+
+def create_jwt_token(
+        user: User,
+        token_type: Literal["access", "refresh"],
+        expires_at: timedelta = configs.ACCESS_TOKEN_LIFETIME,
+        family: str | None = None,
+        generation: int = 0
+) -> str:
+    if token_type == "refresh" and family is None:
+        raise ValueError("A refresh token needs a family, see issue_refresh_token().")
+
+    payload = {
+        "sub": str(user.id),
+        "typ": token_type,
+        "ver": user.token_version or 0,
+        "exp": int(time.time() + expires_at.total_seconds())
+    }
+    if token_type == "access":
+        payload["rol"] = UserRoles(user.role).value
+        payload["act"] = user.is_active
+    else:
+        payload["fam"] = family
+        payload["gen"] = generation
+    return token_backend.encode(payload)
+
+
+def _decode(token: str, token_type: Literal["access", "refresh"], required: tuple[str, ...]) -> dict:
+    try:
+        payload = token_backend.decode(token)
+    except InvalidTokenError:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Authentication failed, invalid or expired token.",
+        )
+
+    if token_type == "refresh" and "sub" not in payload and "user_id" in payload:
+        # Refresh tokens issued before the compact claim names.
+        payload = {
+            "sub": str(payload["user_id"]),
+            "typ": payload.get("token_type"),
+            "ver": payload.get("ver", 0),
+            "exp": payload["exp"]
+        }
+
+    if payload.get("sub") is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Authentication failed, Invalid token.",
+        )
+
+    if payload.get("typ") != token_type:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Authentication failed, invalid token type."
+        )
+
+    if any(claim not in payload for claim in required):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Authentication failed, Invalid token.",
+        )
+
+    return payload
+
+
+def _verify_access_token(token: str) -> dict:
+    return _decode(token, "access", ACCESS_TOKEN_CLAIMS)
+
+
+def decode_access_token(token: str) -> dict:
+    """
+    Verifies an access token and returns its claims.
+
+    Verified claims are cached per worker until the token expires and rejections are cached
+    for a short while, so repeated requests with the same token skip the signature check.
+    """
+    key = hashlib.sha256(token.encode()).digest()
+
+    if (claims := verified_access_tokens.get(key)) is not None:
+        return claims
+
+    if (detail := rejected_access_tokens.get(key)) is not None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail=detail)
+
+    try:
+        claims = _verify_access_token(token)
+    except HTTPException as e:
+        rejected_access_tokens.set(key, e.detail, time.time() + configs.ACCESS_TOKEN_NEGATIVE_CACHE_TTL)
+        raise
+
+    verified_access_tokens.set(key, claims, claims["exp"])
+    return claims
+
+
+def decode_refresh_token(token: str) -> dict:
+    return _decode(token, "refresh", ("exp",))
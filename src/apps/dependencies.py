@@ -2,8 +2,9 @@ from typing import Annotated
 
 from fastapi import Depends
 
+from .auth.schemas import TokenPrincipal
 from .auth.services import get_admin_user, get_active_user
 from .users.models import User
 
 user_dependency = Annotated[User, Depends(get_active_user)]
-admin_dependency = Annotated[User, Depends(get_admin_user)]
+admin_dependency = Annotated[TokenPrincipal, Depends(get_admin_user)]
@@ -0,0 +1,36 @@
+import asyncio
+
+from src.apps.tasks import send_otp_code_emails
+from src.core.settings import configs
+
+
+class EmailBatcher:
+    """
+    Collects the OTP emails of a worker for up to ``window`` seconds or ``size`` messages, whichever
+    comes first, and enqueues them as one send_otp_code_emails task.
+    """
+
+    def __init__(self, window: float, size: int):
+        self.window = window
+        self.size = size
+        self.pending: list[tuple[str, str]] = []
+        self.timer: asyncio.TimerHandle | None = None
+
+    def add(self, email: str, otp_code: str) -> None:
+        self.pending.append((email, otp_code))
+        if len(self.pending) >= self.size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.window, self.flush)
+
+    def flush(self) -> None:
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+        batch, self.pending = self.pending, []
+        if batch:
+            send_otp_code_emails.delay(batch)
+
+
+otp_email_batcher = EmailBatcher(configs.EMAIL_BATCH_WINDOW, configs.EMAIL_BATCH_SIZE)
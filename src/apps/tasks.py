@@ -1,12 +1,96 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+
+from celery.signals import before_task_publish, worker_process_shutdown
+from celery.utils.log import get_task_logger
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
+
+from src.apps.auth.models import Otp, OtpBlacklist, RefreshTokenFamily
+from src.apps.utils import delete_in_batches
+from src.core.settings import configs
 from src.infrastructure.celery_app import celery_app
-from src.infrastructure.email_handler import EmailHandler
+from src.infrastructure.email_handler import EmailHandler, smtp_pool, email_delivery_seconds, retry_delay
+
+logger = get_task_logger(__name__)
+
+
+def otp_code_email(email: str, otp_code: str) -> tuple[str, str, str]:
+    return email, "Welcome to FastAuth", f"Your verification code is {otp_code}"
+
 
+@before_task_publish.connect
+def stamp_enqueue_time(headers: dict, **kwargs):
+    # Retries and re-enqueued batch messages pass the original time along.
+    headers.setdefault("enqueued_at", time.time())
 
-@celery_app.task(bind=True)
+
+def observe_delivery(enqueued_at: float | None, count: int = 1):
+    if enqueued_at is not None and count:
+        email_delivery_seconds.observe(time.time() - enqueued_at, count)
+
+
+@celery_app.task(bind=True, ignore_result=True, acks_late=True)
 def send_otp_code_email(self, email: str, otp_code: str):
-    content = f"Your verification code is {otp_code}"
-    subject = "Welcome to FastAuth"
+    enqueued_at = self.request.get("enqueued_at")
     try:
-        EmailHandler().send_email(email, subject, content)
+        EmailHandler().send_email(*otp_code_email(email, otp_code))
     except Exception as e:
-        self.retry(exc=e, max_retries=3, countdown=10)
+        self.retry(
+            exc=e,
+            max_retries=configs.EMAIL_MAX_RETRIES,
+            countdown=retry_delay(self.request.retries),
+            headers={"enqueued_at": enqueued_at}
+        )
+    observe_delivery(enqueued_at)
+
+
+@celery_app.task(bind=True, ignore_result=True, acks_late=True)
+def send_otp_code_emails(self, messages: list[tuple[str, str]]):
+    """Sends a batch of ``(email, otp_code)`` over one SMTP session, failed ones are retried one by one."""
+    enqueued_at = self.request.get("enqueued_at")
+    failed = EmailHandler().send_emails([otp_code_email(email, otp_code) for email, otp_code in messages])
+    for index in failed:
+        send_otp_code_email.apply_async(messages[index], headers={"enqueued_at": enqueued_at})
+    observe_delivery(enqueued_at, len(messages) - len(failed))
+    logger.info("Sent %s of %s OTP emails", len(messages) - len(failed), len(messages))
+
+
+@worker_process_shutdown.connect
+def close_smtp_connections(**kwargs):
+    smtp_pool.clear()
+
+
+async def _purge(model, condition) -> int:
+    # Every task run gets its own event loop, pooled connections can't outlive it.
+    engine = create_async_engine(configs.DATABASE_URL, poolclass=NullPool)
+    try:
+        async with async_sessionmaker(bind=engine)() as db:
+            return await delete_in_batches(db, model, condition, configs.PURGE_BATCH_SIZE)
+    finally:
+        await engine.dispose()
+
+
+def purge(model, condition) -> dict:
+    started = time.perf_counter()
+    deleted = asyncio.run(_purge(model, condition))
+    report = {"table": model.__tablename__, "deleted": deleted, "seconds": round(time.perf_counter() - started, 3)}
+    logger.info("Purged %(deleted)s rows from %(table)s in %(seconds)ss", report)
+    return report
+
+
+@celery_app.task
+def purge_expired_otps():
+    # Expired codes are kept for OTP_RETENTION, their attempts count towards OTP_MAX_ATTEMPTS until then.
+    return purge(Otp, Otp.expires_at < datetime.now(tz=timezone.utc) - configs.OTP_RETENTION)
+
+
+@celery_app.task
+def purge_expired_otp_blacklist():
+    return purge(OtpBlacklist, OtpBlacklist.expires_at < datetime.now(tz=timezone.utc))
+
+
+@celery_app.task
+def purge_expired_refresh_token_families():
+    return purge(RefreshTokenFamily, RefreshTokenFamily.expires_at < datetime.now(tz=timezone.utc))
@@ -2,15 +2,12 @@ from datetime import datetime
 from enum import Enum
 
 import sqlalchemy as sa
-from argon2 import PasswordHasher
-from argon2.exceptions import VerifyMismatchError
 from sqlalchemy.orm import mapped_column, Mapped
 
+from src.core.hashing import hash_password, verify_password, hash_async, verify_async
 from src.core.settings import configs
 from src.infrastructure.database import Base
 
-pwd_hasher = PasswordHasher()
-
 
 class UserRoles(Enum):
     user = "user"
@@ -19,6 +16,8 @@ class UserRoles(Enum):
 
 class User(Base):
     __tablename__ = "users"
+    # Keyset pagination order, see USER_LIST_KEYS.
+    __table_args__ = (sa.Index("ix_users_created_at_id", "created_at", "id"),)
 
     id: Mapped[int] = mapped_column(primary_key=True)
     username: Mapped[str] = mapped_column(sa.String(length=25), unique=True)
@@ -29,22 +28,36 @@ class User(Base):
         nullable=False
     )
     is_active: Mapped[bool] = mapped_column(default=True, nullable=False)
+    token_version: Mapped[int] = mapped_column(default=0, server_default="0", nullable=False)
     password: Mapped[str] = mapped_column(nullable=False)
     created_at: Mapped[datetime] = mapped_column(sa.DateTime(timezone=True), default=datetime.now)
 
     def hash_password(self, plain_password: str) -> str:
-        return pwd_hasher.hash(plain_password)
+        return hash_password(plain_password)
 
     def verify_password(self, plain_password: str) -> bool:
-        if self.password.startswith(configs.UNUSABLE_PASSWORD_MARKER):
-            return False
-        try:
-            return pwd_hasher.verify(self.password, plain_password)
-        except VerifyMismatchError:
+        if self.has_unusable_password():
             return False
+        return verify_password(self.password, plain_password)
 
     def set_password(self, plain_password: str) -> None:
         self.password = self.hash_password(plain_password)
 
+    async def verify_password_async(self, plain_password: str) -> bool:
+        if self.has_unusable_password():
+            return False
+        return await verify_async(self.password, plain_password)
+
+    async def set_password_async(self, plain_password: str) -> None:
+        self.password = await hash_async(plain_password)
+
+    def has_unusable_password(self) -> bool:
+        return self.password.startswith(configs.UNUSABLE_PASSWORD_MARKER)
+
     def set_unusable_password(self):
         self.password = configs.UNUSABLE_PASSWORD_MARKER
+
+    def revoke_tokens(self) -> int:
+        """Invalidates every token issued so far, returns the new token version."""
+        self.token_version = (self.token_version or 0) + 1
+        return self.token_version
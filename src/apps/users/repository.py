@@ -1,4 +1,4 @@
-from sqlalchemy import select, exists
+from sqlalchemy import select, exists, or_
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from .models import User
@@ -8,11 +8,22 @@ def get_all_users():
     return select(User)
 
 
+# Unique and indexed (ix_users_created_at_id), the order of the keyset pagination of users.
+USER_LIST_KEYS = (User.created_at, User.id)
+
+
 async def get_user_by_id(db: AsyncSession, user_id: int):
     user = await db.get(User, user_id)
     return user
 
 
+async def get_user_token_version(db: AsyncSession, user_id: int) -> int | None:
+    # Decides whether a token is revoked, a lagging replica could let revoked tokens through.
+    stmt = select(User.token_version).where(User.id == user_id).execution_options(read_from_primary=True)
+    result = await db.execute(stmt)
+    return result.scalar_one_or_none()
+
+
 async def get_user_by_email(db: AsyncSession, email: str, for_update: bool = False) -> User | None:
     stmt = select(User).where(User.email == email)
     if for_update:
@@ -22,17 +33,13 @@ async def get_user_by_email(db: AsyncSession, email: str, for_update: bool = Fal
 
 
 async def user_exists_with_email_or_username(db: AsyncSession, email: str, username: str) -> bool:
-    email_stmt = await db.execute(select(exists(User)).where(User.email == email))
-    email_result = email_stmt.scalar()
-
-    username_stmt = await db.execute(select(exists(User)).where(User.username == username))
-    username_result = username_stmt.scalar()
-
-    return email_result or username_result
+    stmt = select(exists().where(or_(User.email == email, User.username == username)))
+    return (await db.execute(stmt)).scalar()
 
 
 async def create_user(db: AsyncSession, user: User) -> User:
+    # Every column but the id has a client side default, which the INSERT ... RETURNING of the flush fetches,
+    # and sessions don't expire on commit, so the user needs no reload.
     db.add(user)
     await db.commit()
-    await db.refresh(user)
     return user
@@ -3,8 +3,14 @@ from typing import Annotated
 from fastapi import APIRouter, status, Query, HTTPException, Request, Response
 from fastapi_cache.decorator import cache
 
-from src.apps.auth.repository import get_otp_by_email
-from src.apps.auth.services import check_blacklist_for_user, is_otp_valid, delete_otp, generate_and_send_otp
+from src.apps.auth.services import (
+    check_blacklist_for_user,
+    get_otp_by_email,
+    is_otp_valid,
+    delete_otp,
+    generate_and_send_otp,
+    announce_token_version
+)
 from src.apps.dependencies import user_dependency, admin_dependency
 from src.apps.utils import auth_responses
 from src.core.limiter import user_limiter, admin_limiter, limiter
@@ -19,7 +25,7 @@ from .schemas import (
     UserUpdateRequest,
     UserActivationRequest
 )
-from .services import get_all_users_paginated
+from .services import get_all_users_paginated, get_all_users_by_cursor
 
 router = APIRouter(
     prefix='/users',
@@ -42,7 +48,12 @@ async def list_users(
         response: Response,
         page: Annotated[int, Query(ge=1)] = 1,
         per_page: Annotated[int, Query(ge=1, le=100)] = 10,
+        cursor: Annotated[
+            str | None, Query(description="Switches to cursor mode, pass an empty cursor for the first page.")
+        ] = None,
 ):
+    if cursor is not None:
+        return {"data": await get_all_users_by_cursor(db, cursor or None, per_page)}
     return {"data": await get_all_users_paginated(db, page, per_page)}
 
 
@@ -138,16 +149,17 @@ async def set_password(
 
     otp_obj = await get_otp_by_email(db, email)
 
-    if not is_otp_valid(otp_code, otp_obj):
+    if not await is_otp_valid(db, otp_code, otp_obj):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid or expired OTP code.")
 
     user = await get_user_by_email(db, email)
 
-    user.set_password(validated_data.new_password.get_secret_value())
+    await user.set_password_async(validated_data.new_password.get_secret_value())
+    user_id, token_version = user.id, user.revoke_tokens()
     db.add(user)
-    await db.commit()
-
     await delete_otp(db, otp_obj)
+    await db.commit()
+    await announce_token_version(user_id, token_version)
 
     return {"data": {"message": "Your password has been changed successfully."}}
 
@@ -175,12 +187,14 @@ async def change_user_password(
     password = change_request.old_password.get_secret_value()
     new_password = change_request.new_password.get_secret_value()
 
-    if not user.verify_password(password):
+    if not await user.verify_password_async(password):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Incorrect password.")
 
-    user.set_password(new_password)
+    await user.set_password_async(new_password)
+    user_id, token_version = user.id, user.revoke_tokens()
     db.add(user)
     await db.commit()
+    await announce_token_version(user_id, token_version)
 
     return {"data": {"message": "Your password has been changed successfully."}}
 
@@ -216,13 +230,17 @@ async def update_user_profile(
     for key, value in update_request_dict.items():
         setattr(user, key, value)
 
+    user_id, token_version = user.id, user.token_version
     if "email" in update_request_dict:
         user.is_active = False
+        token_version = user.revoke_tokens()
         response_message += " Otp Code sent to your new email address."
         await generate_and_send_otp(db, email)
 
     db.add(user)
     await db.commit()
+    if "email" in update_request_dict:
+        await announce_token_version(user_id, token_version)
 
     return {"data": {"message": response_message}}
 
@@ -250,15 +268,14 @@ async def activate_user_account(
 
     otp_obj = await get_otp_by_email(db, email)
 
-    if not is_otp_valid(otp_code, otp_obj):
+    if not await is_otp_valid(db, otp_code, otp_obj):
         raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid or expired OTP code.")
 
     user = await get_user_by_email(db, email, for_update=True)
     user.is_active = True
     db.add(user)
-    await db.commit()
-
     await delete_otp(db, otp_obj)
+    await db.commit()
 
     return {"data": {"message": "Your account has been activated successfully."}}
 
@@ -277,5 +294,7 @@ async def delete_user_profile(
         request: Request,
         response: Response
 ):
+    user_id, token_version = user.id, user.revoke_tokens()
     await db.delete(user)
     await db.commit()
+    await announce_token_version(user_id, token_version)
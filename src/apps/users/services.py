@@ -1,14 +1,18 @@
 from fastapi import HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.core.pagination import paginate
-from .repository import get_all_users, get_user_by_id
+from src.core.pagination import paginate, keyset_paginate
+from .repository import get_all_users, get_user_by_id, USER_LIST_KEYS
 
 
 async def get_all_users_paginated(db: AsyncSession, page: int, per_page: int):
     return await paginate(get_all_users(), db, page=page, per_page=per_page)
 
 
+async def get_all_users_by_cursor(db: AsyncSession, cursor: str | None, per_page: int):
+    return await keyset_paginate(get_all_users(), db, USER_LIST_KEYS, cursor=cursor, per_page=per_page)
+
+
 async def get_user_or_404(db: AsyncSession, user_id: int):
     user = await get_user_by_id(db, user_id)
     if not user:
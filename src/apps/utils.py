@@ -1,5 +1,5 @@
 from fastapi import status
-from sqlalchemy import select
+from sqlalchemy import select, delete
 from sqlalchemy.exc import NoResultFound, IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
@@ -24,6 +24,24 @@ async def get_or_create(db: AsyncSession, model, defaults: dict | None = None, *
             return stmt.first(), False
 
 
+async def delete_in_batches(db: AsyncSession, model, condition, batch_size: int) -> int:
+    """
+    Deletes the rows of ``model`` matching ``condition``, ``batch_size`` rows per transaction.
+
+    Short transactions keep row locks and the amount of dead tuples per commit small.
+    """
+    deleted = 0
+    while True:
+        batch = select(model.id).where(condition).order_by(model.id).limit(batch_size)
+        result = await db.execute(
+            delete(model).where(model.id.in_(batch.scalar_subquery())).execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        deleted += result.rowcount
+        if result.rowcount < batch_size:
+            return deleted
+
+
 auth_responses = {
     status.HTTP_401_UNAUTHORIZED: {
         "model": DataSchema[ErrorResponse],
@@ -0,0 +1,120 @@
+"""
+Benchmarks argon2id on this host and recommends ARGON2_TIME_COST / ARGON2_MEMORY_COST.
+
+Every uvicorn worker may be hashing at the same time during a login burst, so each candidate
+is measured with ``--workers`` hashes running in parallel processes, which is what a single
+login has to compete with on a busy box.
+
+Usage: python -m src.commands.calibrate_hashing --target-ms 250 --workers 9
+"""
+import argparse
+import os
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from argon2 import PasswordHasher, Type
+
+MEMORY_COST_CANDIDATES = (19 * 1024, 32 * 1024, 46 * 1024, 64 * 1024, 96 * 1024, 128 * 1024, 256 * 1024)
+MAX_TIME_COST = 10
+SAMPLE_PASSWORD = "calibration@Password1"
+
+
+def _hash_once(time_cost: int, memory_cost: int, parallelism: int) -> float:
+    hasher = PasswordHasher(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism, type=Type.ID)
+    started = time.perf_counter()
+    hasher.hash(SAMPLE_PASSWORD)
+    return time.perf_counter() - started
+
+
+def measure(pool: ProcessPoolExecutor, workers: int, samples: int, time_cost: int, memory_cost: int,
+            parallelism: int) -> float:
+    """Returns the median per-hash latency in milliseconds while ``workers`` hashes run concurrently."""
+    latencies = []
+    for _ in range(samples):
+        futures = [pool.submit(_hash_once, time_cost, memory_cost, parallelism) for _ in range(workers)]
+        latencies.extend(future.result() for future in futures)
+    return statistics.median(latencies) * 1000
+
+
+def available_memory_kib() -> int | None:
+    try:
+        with open("/proc/meminfo") as meminfo:
+            for line in meminfo:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def calibrate(target_ms: float, workers: int, parallelism: int, samples: int, memory_limit_kib: int | None) -> list[dict]:
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Warm the pool up so process start-up does not count against the first candidate.
+        measure(pool, workers, 1, 1, MEMORY_COST_CANDIDATES[0], parallelism)
+
+        for memory_cost in MEMORY_COST_CANDIDATES:
+            if memory_limit_kib is not None and memory_cost * workers > memory_limit_kib:
+                print(f"memory_cost={memory_cost} KiB: skipped, {workers} workers would exceed the memory limit")
+                continue
+
+            best = None
+            for time_cost in range(1, MAX_TIME_COST + 1):
+                latency = measure(pool, workers, samples, time_cost, memory_cost, parallelism)
+                print(f"memory_cost={memory_cost} KiB time_cost={time_cost}: {latency:.1f} ms")
+                if latency > target_ms:
+                    break
+                best = {"time_cost": time_cost, "memory_cost": memory_cost, "latency_ms": latency}
+
+            if best is None:
+                break
+            results.append(best)
+    return results
+
+
+def recommend(results: list[dict]) -> dict | None:
+    # Cost scales with memory passes, so pick the candidate doing the most work within the budget.
+    return max(results, key=lambda result: result["time_cost"] * result["memory_cost"], default=None)
+
+
+def main():
+    default_workers = 2 * (os.cpu_count() or 1) + 1
+
+    parser = argparse.ArgumentParser(description="Recommend argon2id cost parameters for this host.")
+    parser.add_argument("--target-ms", type=float, default=250, help="Target login latency in milliseconds.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=default_workers,
+        help=f"Number of workers hashing concurrently (default: {default_workers}, as in entrypoint.sh)."
+    )
+    parser.add_argument("--parallelism", type=int, default=4, help="argon2 parallelism (lanes).")
+    parser.add_argument("--samples", type=int, default=3, help="Rounds measured per candidate.")
+    parser.add_argument(
+        "--memory-limit-mib",
+        type=int,
+        default=None,
+        help="Memory available for hashing across all workers (default: MemAvailable)."
+    )
+    args = parser.parse_args()
+
+    memory_limit_kib = args.memory_limit_mib * 1024 if args.memory_limit_mib else available_memory_kib()
+
+    results = calibrate(args.target_ms, args.workers, args.parallelism, args.samples, memory_limit_kib)
+    best = recommend(results)
+
+    if best is None:
+        print(f"No candidate stays under {args.target_ms} ms with {args.workers} concurrent workers.")
+        return
+
+    print()
+    print(f"Recommended for {args.target_ms:.0f} ms with {args.workers} concurrent workers "
+          f"(measured {best['latency_ms']:.1f} ms):")
+    print(f"ARGON2_TIME_COST={best['time_cost']}")
+    print(f"ARGON2_MEMORY_COST={best['memory_cost']}")
+    print(f"ARGON2_PARALLELISM={args.parallelism}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""
+Generates a PEM private key for JWT_PRIVATE_KEY_FILES and prints its kid.
+
+Usage: python -m src.commands.generate_jwt_key --algorithm EdDSA --output keys/jwt-2026-10.pem
+"""
+import argparse
+import os
+from pathlib import Path
+
+from authlib.jose import JsonWebKey
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+
+
+def generate_private_key(algorithm: str):
+    if algorithm == "EdDSA":
+        return ed25519.Ed25519PrivateKey.generate()
+    return rsa.generate_private_key(public_exponent=65537, key_size=3072)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a JWT signing key.")
+    parser.add_argument("--algorithm", choices=["EdDSA", "RS256"], default="EdDSA")
+    parser.add_argument("--output", type=Path, required=True, help="Where to write the PEM private key.")
+    args = parser.parse_args()
+
+    pem = generate_private_key(args.algorithm).private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption()
+    )
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_bytes(pem)
+    os.chmod(args.output, 0o600)
+
+    print(f"Wrote {args.algorithm} key {JsonWebKey.import_key(pem).thumbprint()} to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+"""
+Sends the messages of the email outbox (EMAIL_TRANSPORT=outbox) until interrupted.
+
+Polls every EMAIL_OUTBOX_POLL_INTERVAL seconds while the outbox is empty and drains it in batches of
+EMAIL_OUTBOX_BATCH_SIZE otherwise. Several relays can run at once.
+
+Usage: python -m src.commands.relay_email_outbox
+"""
+import asyncio
+
+from src.apps.auth.outbox import relay_email_outbox
+from src.core.settings import configs
+from src.infrastructure.database import SessionLocal
+from src.infrastructure.email_handler import EmailHandler
+
+
+async def relay_forever(batch_size: int, poll_interval: float):
+    handler = EmailHandler()
+    while True:
+        async with SessionLocal() as db:
+            claimed = await relay_email_outbox(db, handler, batch_size)
+        if claimed < batch_size:
+            await asyncio.sleep(poll_interval)
+
+
+def main():
+    try:
+        asyncio.run(relay_forever(configs.EMAIL_OUTBOX_BATCH_SIZE, configs.EMAIL_OUTBOX_POLL_INTERVAL))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
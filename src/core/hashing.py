@@ -0,0 +1,338 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import math
+import secrets
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import Executor, ThreadPoolExecutor, ProcessPoolExecutor
+
+from argon2 import PasswordHasher, Type
+from argon2.exceptions import VerifyMismatchError, VerificationError, InvalidHashError
+
+from src.core.metrics import metrics, MetricsRegistry
+from src.core.settings import configs, GlobalConfig
+
+
+def _b64encode(value: bytes) -> str:
+    return base64.b64encode(value).decode("ascii").rstrip("=")
+
+
+def _b64decode(value: str) -> bytes:
+    return base64.b64decode(value + "=" * (-len(value) % 4))
+
+
+class BasePasswordHasher(ABC):
+    algorithm: str = ""
+    # Peak memory a single hash allocates, used by the scheduler to budget concurrent hashes.
+    memory_cost_kib: int = 0
+
+    def identify(self, encoded: str) -> bool:
+        return encoded.startswith(f"{self.algorithm}$")
+
+    @abstractmethod
+    def hash(self, plain_password: str) -> str:
+        ...
+
+    @abstractmethod
+    def verify(self, encoded: str, plain_password: str) -> bool:
+        ...
+
+    @abstractmethod
+    def needs_rehash(self, encoded: str) -> bool:
+        ...
+
+
+class Argon2Hasher(BasePasswordHasher):
+    algorithm = "argon2id"
+
+    def __init__(self, time_cost: int, memory_cost: int, parallelism: int):
+        self.hasher = PasswordHasher(
+            time_cost=time_cost,
+            memory_cost=memory_cost,
+            parallelism=parallelism,
+            type=Type.ID
+        )
+        self.memory_cost_kib = memory_cost
+
+    def identify(self, encoded: str) -> bool:
+        return encoded.startswith("$argon2")
+
+    def hash(self, plain_password: str) -> str:
+        return self.hasher.hash(plain_password)
+
+    def verify(self, encoded: str, plain_password: str) -> bool:
+        try:
+            return self.hasher.verify(encoded, plain_password)
+        except (VerifyMismatchError, VerificationError, InvalidHashError):
+            return False
+
+    def needs_rehash(self, encoded: str) -> bool:
+        try:
+            return self.hasher.check_needs_rehash(encoded)
+        except InvalidHashError:
+            return True
+
+
+class ScryptHasher(BasePasswordHasher):
+    algorithm = "scrypt"
+    dklen = 64
+
+    def __init__(self, n: int, r: int, p: int):
+        self.n = n
+        self.r = r
+        self.p = p
+        self.memory_cost_kib = 128 * r * n // 1024
+
+    def _derive(self, plain_password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+        # hashlib refuses to allocate more than 32 MiB unless maxmem is raised explicitly.
+        maxmem = 128 * r * (n + p + 2) + 1024 * 1024
+        return hashlib.scrypt(plain_password.encode(), salt=salt, n=n, r=r, p=p, maxmem=maxmem, dklen=self.dklen)
+
+    def hash(self, plain_password: str) -> str:
+        salt = secrets.token_bytes(16)
+        digest = self._derive(plain_password, salt, self.n, self.r, self.p)
+        return f"{self.algorithm}${self.n}${self.r}${self.p}${_b64encode(salt)}${_b64encode(digest)}"
+
+    def verify(self, encoded: str, plain_password: str) -> bool:
+        try:
+            _, n, r, p, salt, digest = encoded.split("$")
+            expected = self._derive(plain_password, _b64decode(salt), int(n), int(r), int(p))
+        except ValueError:
+            return False
+        return hmac.compare_digest(expected, _b64decode(digest))
+
+    def needs_rehash(self, encoded: str) -> bool:
+        try:
+            _, n, r, p, _, _ = encoded.split("$")
+        except ValueError:
+            return True
+        return (int(n), int(r), int(p)) != (self.n, self.r, self.p)
+
+
+class PBKDF2Hasher(BasePasswordHasher):
+    algorithm = "pbkdf2_sha256"
+
+    def __init__(self, iterations: int):
+        self.iterations = iterations
+
+    def hash(self, plain_password: str) -> str:
+        salt = secrets.token_bytes(16)
+        digest = hashlib.pbkdf2_hmac("sha256", plain_password.encode(), salt, self.iterations)
+        return f"{self.algorithm}${self.iterations}${_b64encode(salt)}${_b64encode(digest)}"
+
+    def verify(self, encoded: str, plain_password: str) -> bool:
+        try:
+            _, iterations, salt, digest = encoded.split("$")
+            expected = hashlib.pbkdf2_hmac("sha256", plain_password.encode(), _b64decode(salt), int(iterations))
+        except ValueError:
+            return False
+        return hmac.compare_digest(expected, _b64decode(digest))
+
+    def needs_rehash(self, encoded: str) -> bool:
+        try:
+            _, iterations, _, _ = encoded.split("$")
+        except ValueError:
+            return True
+        return int(iterations) != self.iterations
+
+
+class PasswordHasherRegistry:
+    """
+    The first hasher hashes every new password, the others are only kept to verify
+    hashes created before the preferred algorithm changed.
+    """
+
+    def __init__(self, hashers: list[BasePasswordHasher]):
+        if not hashers:
+            raise ValueError("At least one password hasher is required.")
+        self.hashers = hashers
+        self.default = hashers[0]
+
+    def identify(self, encoded: str) -> BasePasswordHasher | None:
+        for hasher in self.hashers:
+            if hasher.identify(encoded):
+                return hasher
+        return None
+
+    def hash(self, plain_password: str) -> str:
+        return self.default.hash(plain_password)
+
+    def verify(self, encoded: str, plain_password: str) -> bool:
+        hasher = self.identify(encoded)
+        if hasher is None:
+            return False
+        return hasher.verify(encoded, plain_password)
+
+    def check_needs_rehash(self, encoded: str) -> bool:
+        hasher = self.identify(encoded)
+        if hasher is not self.default:
+            return True
+        return hasher.needs_rehash(encoded)
+
+
+def build_hasher(name: str, config: GlobalConfig) -> BasePasswordHasher:
+    match name:
+        case "argon2id":
+            return Argon2Hasher(
+                time_cost=config.ARGON2_TIME_COST,
+                memory_cost=config.ARGON2_MEMORY_COST,
+                parallelism=config.ARGON2_PARALLELISM
+            )
+        case "scrypt":
+            return ScryptHasher(n=config.SCRYPT_N, r=config.SCRYPT_R, p=config.SCRYPT_P)
+        case "pbkdf2_sha256":
+            return PBKDF2Hasher(iterations=config.PBKDF2_ITERATIONS)
+        case _:
+            raise ValueError(f"Unknown password hasher: {name}")
+
+
+def build_registry(config: GlobalConfig) -> PasswordHasherRegistry:
+    return PasswordHasherRegistry([build_hasher(name, config) for name in config.PASSWORD_HASHERS])
+
+
+password_hashers = build_registry(configs)
+
+_executor: Executor | None = None
+
+
+class HashingOverloaded(Exception):
+    def __init__(self, retry_after: int):
+        self.retry_after = retry_after
+        super().__init__(f"Password hashing queue is full, retry after {retry_after}s.")
+
+
+class HashingScheduler:
+    """
+    Admission control in front of the hashing executor of a single worker.
+
+    At most ``permits`` hashes run at once, where ``permits`` is bounded both by the configured
+    concurrency and by how many hashes fit in the memory budget. Callers beyond that wait in a
+    bounded queue, and once the queue is full new calls are rejected before any hashing starts.
+    """
+
+    def __init__(
+            self,
+            max_concurrency: int,
+            memory_budget_kib: int,
+            memory_per_hash_kib: int,
+            max_queue: int,
+            registry: MetricsRegistry = metrics
+    ):
+        memory_permits = memory_budget_kib // memory_per_hash_kib if memory_per_hash_kib else max_concurrency
+        self.permits = max(1, min(max_concurrency, memory_permits))
+        self.max_queue = max_queue
+        self.waiting = 0
+        self.active = 0
+        self.average_duration = 0.1
+        self._semaphore: asyncio.Semaphore | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+
+        self.wait_seconds = registry.histogram(
+            "password_hashing_wait_seconds",
+            "Time spent waiting for a hashing slot."
+        )
+        self.duration_seconds = registry.histogram(
+            "password_hashing_duration_seconds",
+            "Time spent hashing or verifying a password."
+        )
+        self.rejected = registry.counter(
+            "password_hashing_rejected_total",
+            "Hashing requests rejected because the queue was full."
+        )
+        registry.gauge("password_hashing_queue_depth", "Hashing requests waiting for a slot.", lambda: self.waiting)
+        registry.gauge("password_hashing_active", "Hashes currently running.", lambda: self.active)
+        registry.gauge("password_hashing_permits", "Maximum number of concurrent hashes.", lambda: self.permits)
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        # asyncio primitives are bound to the loop they are first used on.
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.permits)
+            self._loop = loop
+        return self._semaphore
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil((self.waiting + self.active) * self.average_duration / self.permits))
+
+    async def run(self, func, *args):
+        semaphore = self._get_semaphore()
+
+        if semaphore.locked() and self.waiting >= self.max_queue:
+            self.rejected.inc()
+            raise HashingOverloaded(self.retry_after())
+
+        self.waiting += 1
+        queued_at = time.perf_counter()
+        try:
+            await semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        started_at = time.perf_counter()
+        self.wait_seconds.observe(started_at - queued_at)
+        self.active += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(get_executor(), func, *args)
+        finally:
+            duration = time.perf_counter() - started_at
+            self.duration_seconds.observe(duration)
+            self.average_duration = 0.9 * self.average_duration + 0.1 * duration
+            self.active -= 1
+            semaphore.release()
+
+
+scheduler = HashingScheduler(
+    max_concurrency=configs.PASSWORD_HASHING_MAX_CONCURRENCY,
+    memory_budget_kib=configs.PASSWORD_HASHING_MEMORY_BUDGET_MIB * 1024,
+    memory_per_hash_kib=password_hashers.default.memory_cost_kib,
+    max_queue=configs.PASSWORD_HASHING_MAX_QUEUE
+)
+
+
+def hash_password(plain_password: str) -> str:
+    return password_hashers.hash(plain_password)
+
+
+def verify_password(hashed_password: str, plain_password: str) -> bool:
+    return password_hashers.verify(hashed_password, plain_password)
+
+
+def check_needs_rehash(hashed_password: str) -> bool:
+    return password_hashers.check_needs_rehash(hashed_password)
+
+
+def get_executor() -> Executor:
+    """
+    Lazily creates the executor that runs CPU-bound hashing off the event loop.
+
+    argon2 releases the GIL while hashing, so the thread backend already runs hashes in parallel;
+    the process backend trades a pickling round trip for full isolation from the event loop process.
+    """
+    global _executor
+
+    if _executor is None:
+        max_workers = configs.PASSWORD_HASHING_MAX_WORKERS or scheduler.permits
+        if configs.PASSWORD_HASHING_EXECUTOR == "process":
+            _executor = ProcessPoolExecutor(max_workers=max_workers)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="password-hasher")
+    return _executor
+
+
+def shutdown_executor() -> None:
+    global _executor
+
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
+
+
+async def hash_async(plain_password: str) -> str:
+    return await scheduler.run(hash_password, plain_password)
+
+
+async def verify_async(hashed_password: str, plain_password: str) -> bool:
+    return await scheduler.run(verify_password, hashed_password, plain_password)
@@ -0,0 +1,163 @@
+"""
+Minimal in-process metrics rendered in the Prometheus text exposition format.
+
+Values are kept per process, every uvicorn worker exposes its own numbers on /metrics. Shared
+histograms are the exception, they live in Redis.
+"""
+import math
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable
+
+from redis.exceptions import RedisError
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metric(ABC):
+    metric_type: str = ""
+
+    def __init__(self, name: str, description: str):
+        self.name = name
+        self.description = description
+        self._lock = threading.Lock()
+
+    @abstractmethod
+    def samples(self) -> list[tuple[str, float]]:
+        ...
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.metric_type}"]
+        lines.extend(f"{name} {_format_value(value)}" for name, value in self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    metric_type = "counter"
+
+    def __init__(self, name: str, description: str):
+        super().__init__(name, description)
+        self.value = 0.0
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+    def samples(self) -> list[tuple[str, float]]:
+        return [(self.name, self.value)]
+
+
+class Gauge(Metric):
+    metric_type = "gauge"
+
+    def __init__(self, name: str, description: str, function: Callable[[], float] | None = None):
+        super().__init__(name, description)
+        self.value = 0.0
+        self.function = function
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self.value = value
+
+    def samples(self) -> list[tuple[str, float]]:
+        return [(self.name, self.function() if self.function is not None else self.value)]
+
+
+class Histogram(Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name: str, description: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, description)
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * len(self.buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float, count: int = 1) -> None:
+        with self._lock:
+            self.total += value * count
+            self.count += count
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[index] += count
+
+    def samples(self) -> list[tuple[str, float]]:
+        samples = [
+            (f'{self.name}_bucket{{le="{_format_value(bound)}"}}', count)
+            for bound, count in zip(self.buckets, self.counts)
+        ]
+        samples.append((f'{self.name}_bucket{{le="+Inf"}}', self.count))
+        samples.append((f"{self.name}_sum", self.total))
+        samples.append((f"{self.name}_count", self.count))
+        return samples
+
+
+class SharedHistogram(Histogram):
+    """
+    Histogram kept in a Redis hash, for values observed by other processes (Celery workers) than the
+    ones serving /metrics. ``client`` is a synchronous Redis client, observations are lost while Redis
+    is unreachable.
+    """
+
+    def __init__(self, name: str, description: str, client, buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, description, buckets)
+        self.client = client
+        self.key = f"metrics:{name}"
+
+    def observe(self, value: float, count: int = 1) -> None:
+        pipeline = self.client.pipeline(transaction=False)
+        for bound in self.buckets:
+            if value <= bound:
+                pipeline.hincrby(self.key, _format_value(bound), count)
+        pipeline.hincrby(self.key, "count", count)
+        pipeline.hincrbyfloat(self.key, "sum", value * count)
+        try:
+            pipeline.execute()
+        except RedisError:
+            pass
+
+    def samples(self) -> list[tuple[str, float]]:
+        try:
+            values = {key.decode(): float(value) for key, value in self.client.hgetall(self.key).items()}
+        except RedisError:
+            values = {}
+
+        with self._lock:
+            self.counts = [int(values.get(_format_value(bound), 0)) for bound in self.buckets]
+            self.count = int(values.get("count", 0))
+            self.total = values.get("sum", 0.0)
+            return super().samples()
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered.")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, description: str) -> Counter:
+        return self.register(Counter(name, description))
+
+    def gauge(self, name: str, description: str, function: Callable[[], float] | None = None) -> Gauge:
+        return self.register(Gauge(name, description, function))
+
+    def histogram(self, name: str, description: str, buckets: tuple[float, ...] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, description, buckets))
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self.metrics.values()) + "\n"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+metrics = MetricsRegistry()
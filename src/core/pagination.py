@@ -1,5 +1,11 @@
-from sqlalchemy import Select, select, func
+import base64
+import json
+from datetime import datetime
+
+from fastapi import HTTPException, status
+from sqlalchemy import Select, select, func, tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import InstrumentedAttribute
 
 from src.dependencies import db_dependency
 
@@ -46,7 +52,78 @@ class Paginator:
         return count
 
 
+class KeysetPaginator:
+    """
+    Pages through ``query`` ordered by the unique ``keys``, like (created_at, id).
+
+    Pages start right after (or before) the row a cursor points to, so every page costs an index range
+    scan of ``per_page`` rows however deep it is, and there is no total count.
+    """
+
+    def __init__(self, session: AsyncSession, query: Select, keys: tuple[InstrumentedAttribute, ...],
+                 cursor: str | None, per_page: int):
+        self.session = session
+        self.query = query
+        self.keys = keys
+        self.per_page = per_page
+        self.direction, self.position = self._decode_cursor(cursor) if cursor else ("next", None)
+
+    def _encode_cursor(self, direction: str, item) -> str:
+        position = [getattr(item, key.key) for key in self.keys]
+        payload = json.dumps([direction, position], default=datetime.isoformat, separators=(",", ":"))
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    def _decode_cursor(self, cursor: str) -> tuple[str, list]:
+        try:
+            direction, position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if direction not in ("next", "previous") or len(position) != len(self.keys):
+                raise ValueError
+            return direction, [self._decode_value(key, value) for key, value in zip(self.keys, position)]
+        except (ValueError, TypeError):
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor.")
+
+    @staticmethod
+    def _decode_value(key: InstrumentedAttribute, value):
+        # Every value goes through the column type, the database would choke on an id like "x".
+        python_type = key.type.python_type
+        if python_type is datetime:
+            return datetime.fromisoformat(value)
+        if value is None or isinstance(value, (bool, list, dict)):
+            raise TypeError
+        return python_type(value)
+
+    async def get_response(self) -> dict:
+        query = self.query
+        forward = self.direction == "next"
+        if self.position is not None:
+            row, position = tuple_(*self.keys), tuple_(*self.position)
+            query = query.where(row > position if forward else row < position)
+        query = query.order_by(*(key if forward else key.desc() for key in self.keys))
+
+        # One extra row tells whether there is another page in this direction.
+        items = list(await self.session.scalars(query.limit(self.per_page + 1)))
+        has_more = len(items) > self.per_page
+        items = items[:self.per_page]
+        if not forward:
+            items.reverse()
+
+        has_next = has_more if forward else self.position is not None
+        has_previous = self.position is not None if forward else has_more
+        return {
+            'next_cursor': self._encode_cursor("next", items[-1]) if items and has_next else None,
+            'previous_cursor': self._encode_cursor("previous", items[0]) if items and has_previous else None,
+            'items': items
+        }
+
+
 async def paginate(query: Select, db: db_dependency, page: int, per_page: int) -> dict:
     async with db as session:
         paginator = Paginator(session, query, page, per_page)
         return await paginator.get_response()
+
+
+async def keyset_paginate(query: Select, db: db_dependency, keys: tuple[InstrumentedAttribute, ...],
+                          cursor: str | None, per_page: int) -> dict:
+    async with db as session:
+        paginator = KeysetPaginator(session, query, keys, cursor, per_page)
+        return await paginator.get_response()
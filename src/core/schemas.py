@@ -10,10 +10,12 @@ class DataSchema(BaseModel, Generic[DataT]):
 
 
 class PaginatedResponse(BaseModel, Generic[DataT]):
-    count: int = Field(description='Number of total items')
+    count: int | None = Field(None, description='Number of total items, not counted in cursor mode')
     previous_page: int | None = Field(None, description='Previous page if it exists', ge=1)
     next_page: int | None = Field(None, description='Next page if it exists', ge=1)
     last_page: int | None = Field(None, description='Last page', ge=1)
+    previous_cursor: str | None = Field(None, description='Cursor of the previous page if it exists, in cursor mode')
+    next_cursor: str | None = Field(None, description='Cursor of the next page if it exists, in cursor mode')
     items: list[DataT] = Field(description='List of items returned in a paginated response')
 
 
@@ -2,6 +2,9 @@ from datetime import timedelta
 from functools import lru_cache
 from logging.config import dictConfig
 from pathlib import Path
+from typing import Literal, Self
+
+from pydantic import model_validator
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -19,9 +22,14 @@ class GlobalConfig(BaseConfig):
     DATABASE_POOL_SIZE: int
     DATABASE_MAX_OVERFLOW: int
     DATABASE_URL: str = 'sqlite+aiosqlite:///db.sqlite3'
+    DATABASE_REPLICA_URLS: list[str] = []
+    DATABASE_REPLICA_STICKY_SECONDS: int = 5
+    DATABASE_REPLICA_RETRY_AFTER: int = 30
     ALEMBIC_DATABASE_URL: str
     REDIS_URL: str = 'redis://localhost:6379/0'
+    # Per worker, the revocation filter subscription holds one more connection outside this pool.
     REDIS_MAX_CONNECTIONS: int
+    REDIS_SYNC_TIMEOUT: float = 0.25
     CELERY_BROKER_URL: str = 'redis://localhost:6379/1'
     CELERY_RESULT_BACKEND: str = 'redis://localhost:6379/2'
     EMAIL_HOSTNAME: str
@@ -29,15 +37,71 @@ class GlobalConfig(BaseConfig):
     EMAIL_USE_TLS: bool
     EMAIL_HOST_USERNAME: str
     EMAIL_HOST_PASSWORD: str
+    EMAIL_POOL_SIZE: int = 2
+    EMAIL_CONNECTION_MAX_IDLE: int = 60
+    EMAIL_MAX_RETRIES: int = 3
+    EMAIL_RETRY_BACKOFF: int = 2
+    EMAIL_RETRY_BACKOFF_MAX: int = 60
+    EMAIL_TRANSPORT: Literal["celery", "async", "outbox"] = "celery"
+    EMAIL_OUTBOX_BATCH_SIZE: int = 100
+    EMAIL_OUTBOX_POLL_INTERVAL: float = 0.5
+    EMAIL_QUEUE_SIZE: int = 1_000
+    EMAIL_SENDERS: int = 2
+    EMAIL_BATCHING: bool = False
+    EMAIL_BATCH_WINDOW: float = 0.1
+    EMAIL_BATCH_SIZE: int = 50
     TIMEZONE: str
     OTP_EXPIRATION_TIME: timedelta = timedelta(minutes=2)
     OTP_MAX_ATTEMPTS: int = 5
+    OTP_MAX_VERIFY_ATTEMPTS: int = 5
+    OTP_BACKEND: Literal["sql", "redis"] = "sql"
+    OTP_HASHING_MODE: Literal["hmac", "argon2"] = "hmac"
+    OTP_PEPPER: str | None = None
+    OTP_RETENTION: timedelta = timedelta(hours=24)
+    OTP_BLACKLIST_CACHE_TTL: int = 3600
+    OTP_BLACKLIST_NEGATIVE_CACHE_TTL: int = 60
+    PURGE_INTERVAL: timedelta = timedelta(minutes=10)
+    PURGE_BATCH_SIZE: int = 1_000
     UNUSABLE_PASSWORD_MARKER: str = "!UNUSABLE"
+    JWT_ALGORITHM: Literal["HS256", "RS256", "EdDSA"] = "HS256"
+    JWT_PRIVATE_KEY_FILES: list[str] = []
+    JWT_BACKEND: Literal["authlib", "native"] = "authlib"
+    JWKS_CACHE_MAX_AGE: int = 3600
+    ACCESS_TOKEN_LIFETIME: timedelta = timedelta(minutes=15)
+    TOKEN_VERSION_CACHE_TTL: int = 900
+    REFRESH_TOKEN_STORE: Literal["redis", "sql"] = "redis"
+    REVOCATION_FILTER_CAPACITY: int = 100_000
+    REVOCATION_FILTER_ERROR_RATE: float = 0.001
+    ACCESS_TOKEN_CACHE_SIZE: int = 10_000
+    ACCESS_TOKEN_NEGATIVE_CACHE_SIZE: int = 1_000
+    ACCESS_TOKEN_NEGATIVE_CACHE_TTL: int = 30
     CLIENT_ID: str
     CLIENT_SECRET: str
     AUTH_URI: str
     TOKEN_URI: str
     ALLOWED_ORIGINS: list[str]
+    PASSWORD_HASHING_EXECUTOR: Literal["thread", "process"] = "thread"
+    PASSWORD_HASHING_MAX_WORKERS: int | None = None
+    PASSWORD_HASHING_MAX_CONCURRENCY: int = 4
+    PASSWORD_HASHING_MEMORY_BUDGET_MIB: int = 256
+    PASSWORD_HASHING_MAX_QUEUE: int = 32
+    PASSWORD_HASHERS: list[str] = ["argon2id", "scrypt", "pbkdf2_sha256"]
+    ARGON2_TIME_COST: int = 3
+    ARGON2_MEMORY_COST: int = 65536
+    ARGON2_PARALLELISM: int = 4
+    SCRYPT_N: int = 2 ** 15
+    SCRYPT_R: int = 8
+    SCRYPT_P: int = 1
+    PBKDF2_ITERATIONS: int = 600_000
+    METRICS_TOKEN: str | None = None
+
+    @model_validator(mode="after")
+    def check_token_version_cache_ttl(self) -> Self:
+        # The revocation filter only remembers deleted users through the token version cache, their
+        # revoked access tokens must expire before the cached version does.
+        if self.TOKEN_VERSION_CACHE_TTL < self.ACCESS_TOKEN_LIFETIME.total_seconds():
+            raise ValueError("TOKEN_VERSION_CACHE_TTL must be at least ACCESS_TOKEN_LIFETIME.")
+        return self
 
 
 class DevConfig(GlobalConfig):
@@ -68,6 +132,7 @@ class TestConfig(GlobalConfig):
     CLIENT_SECRET: str = ""
     AUTH_URI: str = ""
     TOKEN_URI: str = ""
+    METRICS_TOKEN: str | None = "test-metrics-token"
     DEBUG: bool = True
 
     model_config = SettingsConfigDict(env_file="envs/.test.env", env_prefix="TEST_")
@@ -11,9 +11,29 @@ CELERY_CONFIG = {
     'task_time_limit': 90,
     'task_max_retries': 3,
     'task_default_retry_delay': 30,
+    # OTP emails get their own queue and workers, a user is waiting on every one of them.
+    'task_routes': {
+        'src.apps.tasks.send_otp_code_email': {'queue': 'otp'},
+        'src.apps.tasks.send_otp_code_emails': {'queue': 'otp'},
+    },
+    'worker_prefetch_multiplier': 1,
     'imports': (
         'src.apps.tasks',
-    )
+    ),
+    'beat_schedule': {
+        'purge-expired-otps': {
+            'task': 'src.apps.tasks.purge_expired_otps',
+            'schedule': configs.PURGE_INTERVAL,
+        },
+        'purge-expired-otp-blacklist': {
+            'task': 'src.apps.tasks.purge_expired_otp_blacklist',
+            'schedule': configs.PURGE_INTERVAL,
+        },
+        'purge-expired-refresh-token-families': {
+            'task': 'src.apps.tasks.purge_expired_refresh_token_families',
+            'schedule': configs.PURGE_INTERVAL,
+        },
+    }
 }
 
 celery_app = Celery(__name__)
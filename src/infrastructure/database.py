@@ -1,5 +1,13 @@
-from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
-from sqlalchemy.orm import DeclarativeBase
+import itertools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+
+from sqlalchemy import Engine, event
+from sqlalchemy.exc import OperationalError, InterfaceError, DBAPIError
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncEngine
+from sqlalchemy.orm import DeclarativeBase, Session
 
 from src.core.settings import configs
 
@@ -9,7 +17,128 @@ engine = create_async_engine(
     max_overflow=configs.DATABASE_MAX_OVERFLOW,
 )
 
-SessionLocal = async_sessionmaker(bind=engine)
+
+class ReplicaSet:
+    """
+    The read replicas, picked round robin.
+
+    A replica whose connection fails is left out for ``retry_after`` seconds, its reads go to the
+    remaining replicas or the primary meanwhile. Pooled connections are pinged on checkout, so a
+    replica that went away is noticed before a query is sent to it.
+    """
+
+    def __init__(self, engines: list[AsyncEngine], retry_after: float):
+        self.engines = [engine.sync_engine for engine in engines]
+        self.retry_after = retry_after
+        self.down_until: dict[Engine, float] = {}
+        self._turn = itertools.count()
+
+        for replica in self.engines:
+            event.listen(replica, "handle_error", self._on_error)
+
+    def __bool__(self) -> bool:
+        return bool(self.engines)
+
+    def choose(self) -> Engine | None:
+        now = time.monotonic()
+        healthy = [replica for replica in self.engines if self.down_until.get(replica, 0) <= now]
+        if not healthy:
+            return None
+        return healthy[next(self._turn) % len(healthy)]
+
+    def mark_down(self, replica: Engine) -> None:
+        self.down_until[replica] = time.monotonic() + self.retry_after
+
+    def _on_error(self, context) -> None:
+        if context.is_disconnect or isinstance(context.sqlalchemy_exception, (OperationalError, InterfaceError)):
+            self.mark_down(context.engine)
+
+
+replica_set = ReplicaSet(
+    [
+        create_async_engine(
+            url=url,
+            pool_size=configs.DATABASE_POOL_SIZE,
+            max_overflow=configs.DATABASE_MAX_OVERFLOW,
+            pool_pre_ping=True,
+        )
+        for url in configs.DATABASE_REPLICA_URLS
+    ],
+    retry_after=configs.DATABASE_REPLICA_RETRY_AFTER,
+)
+
+
+class ReadRouting:
+    """
+    Where the reads of the current request go, whether it wrote anything and on behalf of which
+    user, see read_routing().
+    """
+
+    def __init__(self, primary: bool = False):
+        self.primary = primary
+        self.wrote = False
+        self.user_id: int | None = None
+
+
+_read_routing: ContextVar[ReadRouting | None] = ContextVar("read_routing", default=None)
+
+
+@contextmanager
+def read_routing(primary: bool = False) -> Iterator[ReadRouting]:
+    """Sends the reads of every session used inside the block to the primary if ``primary`` is set."""
+    routing = ReadRouting(primary)
+    token = _read_routing.set(routing)
+    try:
+        yield routing
+    finally:
+        _read_routing.reset(token)
+
+
+def current_read_routing() -> ReadRouting | None:
+    return _read_routing.get()
+
+
+class RoutingSession(Session):
+    """
+    Sends plain SELECTs to a replica and everything else to the primary.
+
+    Once a session wrote, it reads from the primary as well, so a request sees its own writes.
+    Statements with the ``read_from_primary`` execution option always go to the primary, for reads
+    that must not lag, like the token version or the OTP code.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        routing = _read_routing.get()
+
+        writes = not getattr(clause, "is_select", False) or getattr(clause, "_for_update_arg", None) is not None
+        if self._flushing or writes:
+            self.info["wrote"] = True
+            if routing is not None:
+                routing.wrote = True
+        elif (
+                replica_set
+                and not self.info.get("wrote")
+                and not (routing is not None and routing.primary)
+                and not clause.get_execution_options().get("read_from_primary")
+        ):
+            replica = self._connect_replica()
+            if replica is not None:
+                return replica
+
+        return super().get_bind(mapper, clause=clause, **kw)
+
+    def _connect_replica(self) -> Engine | None:
+        # Connecting (and pinging) here lets a read fall back to the primary when no replica answers.
+        while (replica := replica_set.choose()) is not None:
+            try:
+                self.connection(bind_arguments={"bind": replica})
+                return replica
+            except DBAPIError:
+                replica_set.mark_down(replica)
+        return None
+
+
+SessionLocal = async_sessionmaker(bind=engine, expire_on_commit=False, sync_session_class=RoutingSession)
 
 
 class Base(DeclarativeBase):
@@ -1,14 +1,61 @@
+import os
 import ssl
-
+import threading
+import time
+from contextlib import contextmanager
 from email.message import EmailMessage
-from smtplib import SMTP, SMTPException
+from functools import lru_cache
+from smtplib import SMTP, SMTPException, SMTPServerDisconnected, SMTPRecipientsRefused, SMTPResponseException
+
+from celery.utils.time import get_exponential_backoff_interval
 
+from src.core.metrics import metrics, SharedHistogram
 from src.core.settings import configs
+from .redis_pool import redis_sync
 
+# Connections idle for longer than this are checked with a NOOP before being reused.
+NOOP_AFTER = 5
+
+
+email_delivery_seconds = metrics.register(SharedHistogram(
+    "email_delivery_seconds",
+    "Time from enqueueing an email until the SMTP server accepted it.",
+    redis_sync,
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+))
+
+
+def retry_delay(retries: int) -> float:
+    """Exponential backoff with full jitter, shared by every email delivery path."""
+    return get_exponential_backoff_interval(
+        configs.EMAIL_RETRY_BACKOFF, retries, configs.EMAIL_RETRY_BACKOFF_MAX, full_jitter=True
+    )
+
+
+@lru_cache()
+def get_ssl_context() -> ssl.SSLContext:
+    # Loading the CA bundle is the expensive part, one context serves every connection of the process.
+    return ssl.create_default_context()
+
+
+class SMTPConnectionPool:
+    """
+    Authenticated SMTP sessions kept open between messages, at most ``size`` idle ones per process.
+
+    Sessions idle for more than ``max_idle`` seconds are closed instead of reused, servers drop them
+    sooner or later anyway. Sessions inherited from a parent process (Celery forks its workers) are
+    abandoned without a QUIT, the socket belongs to the parent.
+    """
+
+    def __init__(self, size: int, max_idle: int):
+        self.size = size
+        self.max_idle = max_idle
+        self.lock = threading.Lock()
+        self.idle: list[tuple[SMTP, float]] = []
+        self.pid = os.getpid()
 
-class EmailHandler:
     @staticmethod
-    def _login(smtp):
+    def _login(smtp: SMTP):
         try:
             smtp.login(
                 user=configs.EMAIL_HOST_USERNAME,
@@ -18,6 +65,81 @@ class EmailHandler:
             pass
             # add logger
 
+    def _connect(self) -> SMTP:
+        smtp = SMTP(host=configs.EMAIL_HOSTNAME, port=configs.EMAIL_PORT)
+        try:
+            if configs.EMAIL_USE_TLS:
+                smtp.starttls(context=get_ssl_context())
+            self._login(smtp)
+        except BaseException:
+            self._close(smtp)
+            raise
+        return smtp
+
+    @staticmethod
+    def _close(smtp: SMTP):
+        try:
+            smtp.quit()
+        except (SMTPException, OSError):
+            smtp.close()
+
+    @staticmethod
+    def _is_alive(smtp: SMTP) -> bool:
+        try:
+            return smtp.noop()[0] == 250
+        except (SMTPException, OSError):
+            return False
+
+    def _checkout(self) -> SMTP:
+        while True:
+            with self.lock:
+                if self.pid != os.getpid():
+                    self.idle, self.pid = [], os.getpid()
+                if not self.idle:
+                    break
+                # Most recently used first, it's the likeliest to still be open.
+                smtp, released_at = self.idle.pop()
+
+            idle_for = time.monotonic() - released_at
+            if idle_for < self.max_idle and (idle_for < NOOP_AFTER or self._is_alive(smtp)):
+                return smtp
+            self._close(smtp)
+
+        return self._connect()
+
+    def _release(self, smtp: SMTP):
+        with self.lock:
+            if self.pid == os.getpid() and len(self.idle) < self.size:
+                self.idle.append((smtp, time.monotonic()))
+                return
+        self._close(smtp)
+
+    @contextmanager
+    def connection(self):
+        """Yields an authenticated session, which goes back to the pool unless the block raised."""
+        smtp = self._checkout()
+        try:
+            yield smtp
+        except BaseException:
+            # The session may be mid-transaction or gone, it isn't worth saving.
+            self._close(smtp)
+            raise
+        self._release(smtp)
+
+    def clear(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for smtp, _ in idle:
+            self._close(smtp)
+
+
+smtp_pool = SMTPConnectionPool(configs.EMAIL_POOL_SIZE, configs.EMAIL_CONNECTION_MAX_IDLE)
+
+
+class EmailHandler:
+    def __init__(self, pool: SMTPConnectionPool = smtp_pool):
+        self.pool = pool
+
     @staticmethod
     def _prepare_message(to: str, subject: str, body: str) -> EmailMessage:
         msg = EmailMessage()
@@ -30,11 +152,27 @@ class EmailHandler:
     def send_email(self, to: str, subject: str, body: str):
         msg = self._prepare_message(to, subject, body)
 
-        with SMTP(host=configs.EMAIL_HOSTNAME, port=configs.EMAIL_PORT) as smtp:
-            if configs.EMAIL_USE_TLS:
-                context = ssl.create_default_context()
-                smtp.starttls(context=context)
-
-            self._login(smtp)
-            smtp.send_message(msg)
+        try:
+            with self.pool.connection() as smtp:
+                smtp.send_message(msg)
+        except SMTPServerDisconnected:
+            # A pooled session the server closed in between, once more on a new one.
+            with self.pool.connection() as smtp:
+                smtp.send_message(msg)
 
+    def send_emails(self, messages: list[tuple[str, str, str]]) -> list[int]:
+        """
+        Sends ``(to, subject, body)`` messages over one session, returns the indexes of the ones that
+        weren't sent. A message the server refuses doesn't stop the others, a dropped session does.
+        """
+        failed, index = [], 0
+        try:
+            with self.pool.connection() as smtp:
+                for index, (to, subject, body) in enumerate(messages):
+                    try:
+                        smtp.send_message(self._prepare_message(to, subject, body))
+                    except (SMTPRecipientsRefused, SMTPResponseException):
+                        failed.append(index)
+        except (SMTPException, OSError):
+            failed.extend(range(index, len(messages)))
+        return failed
@@ -0,0 +1,101 @@
+import asyncio
+import itertools
+import logging
+import time
+
+from src.core.metrics import metrics, MetricsRegistry
+from src.core.settings import configs
+from .email_handler import EmailHandler, SMTPConnectionPool, email_delivery_seconds, retry_delay
+
+logger = logging.getLogger("app")
+
+QUEUE_FULL_RETRY_AFTER = 10
+
+
+class EmailQueueFull(Exception):
+    def __init__(self, retry_after: int):
+        self.retry_after = retry_after
+        super().__init__(f"Email queue is full, retry after {retry_after}s.")
+
+
+class AsyncEmailTransport:
+    """
+    Sends emails from the API worker itself, for deployments without Celery.
+
+    Messages wait in a queue of at most ``queue_size`` and are sent by ``senders`` tasks, each one
+    running the blocking SMTP exchange over the pooled sessions in a thread. Only lives between
+    start() and stop(), which sends whatever is still queued or waiting to be retried.
+    """
+
+    def __init__(self, queue_size: int, senders: int, registry: MetricsRegistry = metrics):
+        self.queue_size = queue_size
+        self.senders = senders
+        self.handler = EmailHandler(SMTPConnectionPool(senders, configs.EMAIL_CONNECTION_MAX_IDLE))
+        self.queue: asyncio.Queue | None = None
+        self.tasks: list[asyncio.Task] = []
+        self.retries: dict[int, tuple[asyncio.TimerHandle, tuple[str, str, str, float, int]]] = {}
+        self._retry_ids = itertools.count()
+
+        registry.gauge(
+            "email_queue_depth", "Emails waiting to be sent in-process.", lambda: self.queue.qsize() if self.queue else 0
+        )
+
+    def start(self) -> None:
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.tasks = [asyncio.create_task(self._send_forever()) for _ in range(self.senders)]
+
+    async def stop(self) -> None:
+        await self.queue.join()
+        # Retries don't wait for their backoff anymore, until every message was sent or given up on.
+        while self.retries:
+            for retry_id in list(self.retries):
+                handle, message = self.retries.pop(retry_id)
+                handle.cancel()
+                await self.queue.put(message)
+            await self.queue.join()
+
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        self.handler.pool.clear()
+
+    def send(self, to: str, subject: str, body: str) -> None:
+        self._put((to, subject, body, time.time(), 0))
+
+    def _put(self, message: tuple[str, str, str, float, int]) -> None:
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            raise EmailQueueFull(retry_after=QUEUE_FULL_RETRY_AFTER)
+
+    def _deliver(self, to: str, subject: str, body: str, enqueued_at: float) -> None:
+        self.handler.send_email(to, subject, body)
+        email_delivery_seconds.observe(time.time() - enqueued_at)
+
+    async def _send_forever(self) -> None:
+        while True:
+            to, subject, body, enqueued_at, retries = message = await self.queue.get()
+            try:
+                await asyncio.to_thread(self._deliver, to, subject, body, enqueued_at)
+            except Exception as e:
+                # Same policy as the send_otp_code_email task.
+                if retries < configs.EMAIL_MAX_RETRIES:
+                    retry = (*message[:4], retries + 1)
+                    retry_id = next(self._retry_ids)
+                    handle = asyncio.get_running_loop().call_later(retry_delay(retries), self._retry, retry_id)
+                    self.retries[retry_id] = (handle, retry)
+                else:
+                    logger.error("Giving up on email to %s: %s", to, e)
+            finally:
+                self.queue.task_done()
+
+    def _retry(self, retry_id: int) -> None:
+        _, message = self.retries.pop(retry_id)
+        try:
+            self._put(message)
+        except EmailQueueFull:
+            logger.error("Dropped email to %s, the queue is full", message[0])
+
+
+email_transport = AsyncEmailTransport(configs.EMAIL_QUEUE_SIZE, configs.EMAIL_SENDERS)
@@ -1,4 +1,4 @@
-from redis import asyncio as redis
+from redis import asyncio as redis, Redis
 
 from src.core.settings import configs
 
@@ -8,3 +8,15 @@ fastapi_redis_pool = redis.ConnectionPool.from_url(
 )
 
 redis_fastapi = redis.Redis(connection_pool=fastapi_redis_pool)
+
+# The revocation filter subscription holds its connection for the lifetime of the worker, so it
+# gets its own client instead of taking one out of the bounded pool above.
+redis_subscriber = redis.Redis.from_url(configs.REDIS_URL)
+
+# For the few callers outside the event loop (Celery tasks, threads). They only record metrics, a
+# hung Redis must cost them a short timeout, not the task or the /metrics scrape.
+redis_sync = Redis.from_url(
+    configs.REDIS_URL,
+    socket_timeout=configs.REDIS_SYNC_TIMEOUT,
+    socket_connect_timeout=configs.REDIS_SYNC_TIMEOUT,
+)
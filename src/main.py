@@ -1,9 +1,12 @@
-from contextlib import asynccontextmanager
+import asyncio
+import hmac
+from contextlib import asynccontextmanager, suppress
 
 import sentry_sdk
-from fastapi import FastAPI, status, Request
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, status, Request, Depends, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi_cache import FastAPICache
 from fastapi_cache.backends.redis import RedisBackend
 from slowapi import _rate_limit_exceeded_handler
@@ -11,12 +14,19 @@ from slowapi.errors import RateLimitExceeded
 from starlette.exceptions import HTTPException as StarletteHTTPException
 from starlette.middleware.sessions import SessionMiddleware
 
-from src.apps.auth.router import router as auth_router
+from src.apps.auth.revocation import revocation_filter
+from src.apps.auth.services import remember_recent_write
+from src.apps.auth.router import router as auth_router, well_known_router
+from src.apps.email_batcher import otp_email_batcher
 from src.apps.users.router import router as user_router
+from src.core.hashing import shutdown_executor, HashingOverloaded
 from src.core.limiter import limiter
+from src.core.metrics import metrics
 from src.core.schemas import DataSchema, HealthCheckResponse
 from src.core.settings import configs, setup_logging
-from src.infrastructure.redis_pool import redis_fastapi
+from src.infrastructure.database import SessionLocal, read_routing, replica_set
+from src.infrastructure.email_transport import email_transport, EmailQueueFull
+from src.infrastructure.redis_pool import redis_fastapi, redis_subscriber
 
 setup_logging()
 
@@ -43,11 +53,22 @@ sentry_sdk.init(
 async def lifespan(app: FastAPI):
     backend = RedisBackend(redis_fastapi)
     FastAPICache().init(backend=backend, prefix="FastAuth_")
+    revocation_task = asyncio.create_task(revocation_filter.run(redis_subscriber, SessionLocal))
+    if configs.EMAIL_TRANSPORT == "async":
+        email_transport.start()
 
     yield
 
+    revocation_task.cancel()
+    with suppress(asyncio.CancelledError):
+        await revocation_task
+    otp_email_batcher.flush()
+    if configs.EMAIL_TRANSPORT == "async":
+        await email_transport.stop()
+    shutdown_executor()
     await redis_fastapi.close()
     await redis_fastapi.connection_pool.disconnect()
+    await redis_subscriber.close()
 
 
 app = FastAPI(
@@ -68,6 +89,7 @@ app.state.limiter = limiter
 
 app.include_router(user_router)
 app.include_router(auth_router)
+app.include_router(well_known_router)
 
 app.add_middleware(SessionMiddleware, secret_key=configs.SECRET_KEY)
 app.add_middleware(
@@ -78,6 +100,16 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def route_database_reads(request: Request, call_next):
+    # Requests that may write read from the primary, what they write can depend on what they read.
+    with read_routing(primary=request.method not in ("GET", "HEAD")) as routing:
+        response = await call_next(request)
+
+    if routing.wrote and routing.user_id is not None and replica_set:
+        await remember_recent_write(routing.user_id)
+    return response
+
 
 @app.exception_handler(StarletteHTTPException)
 async def http_exception_handler(request: Request, exc: StarletteHTTPException):
@@ -88,6 +120,16 @@ async def http_exception_handler(request: Request, exc: StarletteHTTPException):
     )
 
 
+async def service_busy_handler(request: Request, exc: HashingOverloaded | EmailQueueFull):
+    return JSONResponse(
+        content={"data": {"errors": "Service is busy, please try again later."}},
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+app.add_exception_handler(HashingOverloaded, service_busy_handler)
+app.add_exception_handler(EmailQueueFull, service_busy_handler)
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
 
@@ -96,6 +138,27 @@ async def health_check():
     return DataSchema(data={'status': 'OK'})
 
 
+metrics_bearer = HTTPBearer(auto_error=False)
+
+
+def check_metrics_token(credentials: HTTPAuthorizationCredentials | None = Depends(metrics_bearer)) -> None:
+    # Without a METRICS_TOKEN the endpoint isn't served at all.
+    if not configs.METRICS_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if credentials is None or not hmac.compare_digest(credentials.credentials.encode(), configs.METRICS_TOKEN.encode()):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+
+
+@app.get('/metrics', include_in_schema=False, dependencies=[Depends(check_metrics_token)])
+def export_metrics():
+    # Shared histograms are read from Redis synchronously, rendered in the threadpool.
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/sentry-debug")
 async def trigger_error():
     division_by_zero = 1 / 0
@@ -1,24 +1,28 @@
-from datetime import datetime, timedelta
-from typing import AsyncGenerator
+from datetime import datetime, timedelta, timezone
+from typing import AsyncGenerator, Generator
 
+import pytest
 import pytest_asyncio
 from argon2 import PasswordHasher
 from httpx import AsyncClient, ASGITransport
+from sqlalchemy import event, delete
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 
 from src.apps.auth.models import Otp
-from src.apps.auth.services import create_jwt_token
+from src.apps.auth.otp import otp_digest
+from src.apps.auth.tokens import create_jwt_token
 from src.apps.users.models import User, UserRoles
 from src.core.configs.settings import configs
 from src.dependencies import get_db
 from src.infrastructure.database import Base
+from src.infrastructure.redis_pool import redis_fastapi
 from src.main import app
 
 hasher = PasswordHasher()
 
 engine = create_async_engine(url=configs.DATABASE_URL)
 
-AsyncTestSessionLocal = async_sessionmaker(bind=engine)
+AsyncTestSessionLocal = async_sessionmaker(bind=engine, expire_on_commit=False)
 
 
 @pytest_asyncio.fixture(scope="session")
@@ -45,6 +49,62 @@ async def tear_up_and_down_database():
         await conn.run_sync(Base.metadata.drop_all)
 
 
+@pytest.fixture(scope="function")
+def sql_statements() -> Generator[list[str], None, None]:
+    """
+    Records the SQL statements, and the commits as "COMMIT", sent to the database while the test runs.
+
+    BEGIN is left out, the driver sends it implicitly along with the first statement.
+    """
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    def record_commit(conn):
+        statements.append("COMMIT")
+
+    event.listen(engine.sync_engine, "before_cursor_execute", record)
+    event.listen(engine.sync_engine, "commit", record_commit)
+    yield statements
+    event.remove(engine.sync_engine, "before_cursor_execute", record)
+    event.remove(engine.sync_engine, "commit", record_commit)
+
+
+@pytest_asyncio.fixture(scope="function")
+async def otp_factory(overrides_get_db):
+    """
+    Stores the code 123456 for an email, the row is removed once the test is done if it still exists.
+
+    The codes are held on to so they stay in the session: the routes get them back with the
+    timezone-aware expiry SQLite would drop.
+    """
+    otps = []
+
+    async def create(email: str) -> Otp:
+        otp = Otp(
+            email=email,
+            code_digest=otp_digest(email, "123456"),
+            expires_at=datetime.now(tz=timezone.utc) + timedelta(minutes=2)
+        )
+        overrides_get_db.add(otp)
+        await overrides_get_db.commit()
+        otps.append(otp)
+        return otp
+
+    yield create
+
+    await overrides_get_db.execute(delete(Otp).where(Otp.id.in_([otp.id for otp in otps])))
+    await overrides_get_db.commit()
+
+
+@pytest.fixture(scope="function")
+def token_version_announcements(mocker):
+    """Stands in for the Redis calls announcing token versions, which fail the request without Redis."""
+    mocker.patch("src.apps.auth.services.raise_token_version", mocker.AsyncMock())
+    return mocker.patch.object(redis_fastapi, "publish", mocker.AsyncMock())
+
+
 @pytest_asyncio.fixture(scope="function")
 async def generate_test_user(overrides_get_db):
     user = User(username="testuser", email="testuser@gmail.com")
@@ -114,14 +174,14 @@ async def anon_client() -> AsyncGenerator[AsyncClient, None]:
 
 @pytest_asyncio.fixture(scope="function")
 async def user_auth_client(overrides_get_db, anon_client, generate_test_user) -> AsyncGenerator[AsyncClient, None]:
-    access_token = create_jwt_token(generate_test_user.id, generate_test_user.email, "access")
+    access_token = create_jwt_token(generate_test_user, "access")
     anon_client.headers["Authorization"] = f"Bearer {access_token}"
     yield anon_client
 
 
 @pytest_asyncio.fixture(scope="function")
 async def admin_auth_client(overrides_get_db, anon_client, generate_admin_user) -> AsyncGenerator[AsyncClient, None]:
-    access_token = create_jwt_token(generate_admin_user.id, generate_admin_user.email, "access")
+    access_token = create_jwt_token(generate_admin_user, "access")
     anon_client.headers["Authorization"] = f"Bearer {access_token}"
     yield anon_client
 
@@ -132,6 +192,6 @@ async def inactive_user_client(
         anon_client,
         generate_inactive_user
 ) -> AsyncGenerator[AsyncClient, None]:
-    access_token = create_jwt_token(generate_inactive_user.id, generate_inactive_user.email, "access")
+    access_token = create_jwt_token(generate_inactive_user, "access")
     anon_client.headers["Authorization"] = f"Bearer {access_token}"
     yield anon_client
@@ -1,17 +1,35 @@
 from datetime import datetime, timedelta
 
 import pytest
+from authlib.jose import OKPKey, OctKey
 from fastapi import HTTPException
-from sqlalchemy import select
-
-from src.apps.auth.models import Otp
-from src.apps.auth.services import create_jwt_token
+from redis.exceptions import RedisError
+from sqlalchemy import select, delete
+from sqlalchemy.exc import SQLAlchemyError
+
+from src.apps.auth.keys import KeyRing, InvalidTokenError
+from src.apps.auth.models import Otp, EmailOutbox
+from src.apps.auth.outbox import relay_email_outbox, seal_body, open_body
+from src.apps.auth.otp import otp_digest, verify_otp_code, SQLOtpStore
+from src.apps.auth.refresh_tokens import SQLRefreshTokenFamilyStore, issue_refresh_token
+from src.apps.auth.services import (
+    is_otp_valid,
+    check_blacklist_for_user,
+    generate_and_send_otp,
+    get_token_version,
+    announce_token_version,
+    authenticate_user
+)
+from src.apps.auth.tokens import create_jwt_token, decode_access_token, _verify_access_token, NativeBackend
+from src.apps.users.models import User, UserRoles
+from src.apps.utils import delete_in_batches
+from src.core.hashing import PBKDF2Hasher
 
 
 @pytest.mark.asyncio
 async def test_request_otp_to_register_success(anon_client, mocker):
     mock_generate_otp = mocker.patch("src.apps.auth.services.generate_otp")
-    mock_generate_otp.return_value = (mocker.ANY, "123456", "hashed_code", True, datetime.now() + timedelta(minutes=2))
+    mock_generate_otp.return_value = ("123456", True)
 
     mock_send_otp_task = mocker.patch("src.apps.auth.services.send_otp_code_email", return_value=None)
     mock_send_otp_task.delay = mocker.MagicMock()
@@ -53,6 +71,48 @@ async def test_request_otp_to_register_blacklisted_with_time(anon_client, mocker
     assert response.status_code == 403
 
 
+@pytest.mark.asyncio
+async def test_check_blacklist_for_user_is_cached(overrides_get_db, mocker):
+    mock_redis = mocker.patch("src.apps.auth.services.redis_fastapi")
+    mock_redis.get = mocker.AsyncMock(side_effect=[None, b""])
+    mock_redis.set = mocker.AsyncMock()
+    mock_get_blacklist = mocker.patch("src.apps.auth.services.get_active_blacklist_by_email", return_value=None)
+
+    assert await check_blacklist_for_user(overrides_get_db, "newuser@gmail.com") is None
+    assert await check_blacklist_for_user(overrides_get_db, "newuser@gmail.com") is None
+
+    mock_get_blacklist.assert_called_once()
+    mock_redis.set.assert_called_once_with("otp_blacklist:newuser@gmail.com", "", ex=60)
+
+
+@pytest.mark.asyncio
+async def test_get_token_version_fills_cache_only_if_absent(overrides_get_db, mocker):
+    mock_redis = mocker.patch("src.apps.auth.services.redis_fastapi")
+    mock_redis.get = mocker.AsyncMock(return_value=None)
+    mock_redis.set = mocker.AsyncMock()
+    mocker.patch("src.apps.auth.services.get_user_token_version", return_value=3)
+
+    assert await get_token_version(overrides_get_db, 7) == 3
+
+    # A version announced since the read must win.
+    mock_redis.set.assert_called_once_with("user:7:token_version", 3, ex=900, nx=True)
+
+
+@pytest.mark.asyncio
+async def test_announce_token_version_drops_cache_it_cannot_update(mocker):
+    mock_redis = mocker.patch("src.apps.auth.services.redis_fastapi")
+    mock_redis.delete = mocker.AsyncMock()
+    mocker.patch("src.apps.auth.services.raise_token_version", mocker.AsyncMock(side_effect=RedisError))
+    mocker.patch("src.apps.auth.services.revocation_filter.publish", mocker.AsyncMock())
+
+    await announce_token_version(7, 4)
+    mock_redis.delete.assert_called_once_with("user:7:token_version")
+
+    mock_redis.delete.side_effect = RedisError
+    with pytest.raises(RedisError):
+        await announce_token_version(7, 4)
+
+
 @pytest.mark.asyncio
 async def test_request_otp_to_register_permanently_blacklisted(anon_client, mocker):
     mock_blacklist_checker = mocker.patch("src.apps.auth.router.check_blacklist_for_user")
@@ -93,13 +153,55 @@ async def test_verify_otp_code_success(overrides_get_db, anon_client, generate_t
     response = await anon_client.post("/auth/register/verify", json=request_data)
 
     mock_get_otp.assert_called_once_with(mocker.ANY, "newuser@gmail.com")
-    mock_otp_validator.assert_called_once_with("123456", generate_test_otp)
+    mock_otp_validator.assert_called_once_with(mocker.ANY, "123456", generate_test_otp)
 
     assert response.status_code == 201
     assert response.json()["data"]["user"]["email"] == "newuser@gmail.com"
     assert (await overrides_get_db.scalars(select(Otp))).all() == []
 
 
+@pytest.mark.asyncio
+async def test_verify_otp_code_statement_count(overrides_get_db, anon_client, sql_statements, otp_factory):
+    await otp_factory("counted@gmail.com")
+    sql_statements.clear()
+
+    request_data = {
+        "email": "counted@gmail.com",
+        "username": "counted",
+        "password": "new@userPassword1",
+        "confirm_password": "new@userPassword1",
+        "otp_code": "123456",
+    }
+    response = await anon_client.post("/auth/register/verify", json=request_data)
+    statements = list(sql_statements)
+    await overrides_get_db.execute(delete(User).where(User.email == "counted@gmail.com"))
+    await overrides_get_db.commit()
+
+    assert response.status_code == 201
+    # Load the code, count the attempt, check the email and username, then delete the code and insert the user.
+    assert len(statements) == 7
+    assert statements.count("COMMIT") == 2
+
+
+@pytest.mark.asyncio
+async def test_request_otp_to_register_statement_count(overrides_get_db, anon_client, sql_statements, mocker):
+    mocker.patch("src.apps.auth.services.send_otp_code_email.delay")
+    # A blacklist cache miss whether Redis runs or not, a cached answer would skip its SELECT.
+    mock_redis = mocker.patch("src.apps.auth.services.redis_fastapi")
+    mock_redis.get = mocker.AsyncMock(return_value=None)
+    mock_redis.set = mocker.AsyncMock()
+
+    response = await anon_client.post("/auth/register", json={"email": "counted@gmail.com"})
+    statements = list(sql_statements)
+    await overrides_get_db.execute(delete(Otp).where(Otp.email == "counted@gmail.com"))
+    await overrides_get_db.commit()
+
+    assert response.status_code == 202
+    # Check the blacklist and the email, then upsert the code.
+    assert len(statements) == 4
+    assert statements.count("COMMIT") == 1
+
+
 @pytest.mark.asyncio
 async def test_verify_otp_code_passwords_does_not_match(overrides_get_db, generate_test_otp, anon_client):
     request_data = {
@@ -158,6 +260,35 @@ async def test_verify_otp_code_invalid(overrides_get_db, anon_client, generate_t
     assert (await overrides_get_db.scalars(select(Otp))).all() == [generate_test_otp]
 
 
+@pytest.mark.asyncio
+async def test_is_otp_valid_with_hmac_digest(overrides_get_db, mocker):
+    mocker.patch("src.apps.auth.services.datetime", wraps=datetime)
+    mocker.patch("src.apps.auth.services.datetime.now", return_value=datetime.now())
+    otp = Otp(
+        email="newuser@gmail.com",
+        code_digest=otp_digest("otheruser@gmail.com", "123456"),
+        expires_at=datetime.now() + timedelta(minutes=2)
+    )
+    overrides_get_db.add(otp)
+    await overrides_get_db.commit()
+    await overrides_get_db.refresh(otp)
+
+    # A digest computed for another address doesn't match.
+    assert await is_otp_valid(overrides_get_db, "123456", otp) is False
+
+    await overrides_get_db.refresh(otp)
+    otp.code_digest = otp_digest("newuser@gmail.com", "123456")
+    await overrides_get_db.commit()
+
+    await overrides_get_db.refresh(otp)
+    assert await is_otp_valid(overrides_get_db, "123457", otp) is False
+    await overrides_get_db.refresh(otp)
+    assert await is_otp_valid(overrides_get_db, "123456", otp) is True
+
+    await overrides_get_db.delete(otp)
+    await overrides_get_db.commit()
+
+
 @pytest.mark.asyncio
 async def test_verify_otp_code_user_already_exists(overrides_get_db, anon_client, generate_test_otp, mocker):
     mocker.patch("src.apps.auth.router.get_otp_by_email", return_value=generate_test_otp)
@@ -173,7 +304,7 @@ async def test_verify_otp_code_user_already_exists(overrides_get_db, anon_client
     }
     response = await anon_client.post("/auth/register/verify", json=request_data)
 
-    mock_otp_validator.assert_called_once_with("123456", generate_test_otp)
+    mock_otp_validator.assert_called_once_with(mocker.ANY, "123456", generate_test_otp)
 
     assert response.status_code == 400
     assert (await overrides_get_db.scalars(select(Otp))).all() == [generate_test_otp]
@@ -208,13 +339,87 @@ async def test_user_login_incorrect_email_or_password(anon_client):
 
 
 @pytest.mark.asyncio
-async def test_refresh_token_success(anon_client, generate_test_user):
-    refresh_token = create_jwt_token(
-        generate_test_user.id,
-        generate_test_user.email,
-        "refresh",
-        expires_at=timedelta(hours=24)
-    )
+async def test_user_login_rehashes_outdated_password(overrides_get_db, anon_client, generate_test_user):
+    generate_test_user.password = PBKDF2Hasher(iterations=1000).hash("new@userPassword1")
+    await overrides_get_db.commit()
+
+    request_data = {
+        "email": "testuser@gmail.com",
+        "password": "new@userPassword1"
+    }
+
+    response = await anon_client.post("/auth/login", json=request_data)
+    await overrides_get_db.refresh(generate_test_user)
+
+    assert response.status_code == 200
+    assert generate_test_user.password.startswith("$argon2id$")
+
+
+@pytest.mark.asyncio
+async def test_authenticate_user_keeps_old_hash_when_rehash_fails(overrides_get_db, generate_test_user, mocker):
+    old_hash = PBKDF2Hasher(iterations=1000).hash("new@userPassword1")
+    generate_test_user.password = old_hash
+    await overrides_get_db.commit()
+    mocker.patch.object(overrides_get_db, "commit", mocker.AsyncMock(side_effect=SQLAlchemyError))
+
+    user = await authenticate_user(overrides_get_db, "testuser@gmail.com", "new@userPassword1")
+
+    assert user.id == generate_test_user.id
+    assert user.password == old_hash
+
+
+@pytest.mark.asyncio
+async def test_sql_otp_store(overrides_get_db, mocker):
+    mocker.patch("src.apps.auth.otp.configs.OTP_MAX_ATTEMPTS", 2)
+    store = SQLOtpStore()
+    expires_at = datetime.now() + timedelta(minutes=2)
+
+    assert await store.issue(overrides_get_db, "store@gmail.com", "111111", expires_at) is True
+    assert await store.issue(overrides_get_db, "store@gmail.com", "222222", expires_at) is True
+    assert await store.issue(overrides_get_db, "store@gmail.com", "333333", expires_at) is False
+
+    otp = await store.get(overrides_get_db, "store@gmail.com")
+    assert await store.verify(overrides_get_db, otp, "111111", datetime.now()) is False
+    otp = await store.get(overrides_get_db, "store@gmail.com")
+    assert await store.verify(overrides_get_db, otp, "222222", datetime.now()) is True
+
+    await store.consume(overrides_get_db, otp)
+    await overrides_get_db.commit()
+    assert await store.get(overrides_get_db, "store@gmail.com") is None
+
+
+@pytest.mark.asyncio
+async def test_sql_otp_store_caps_verify_attempts(overrides_get_db, mocker):
+    mocker.patch("src.apps.auth.otp.configs.OTP_MAX_VERIFY_ATTEMPTS", 2)
+    mock_verify_otp_code = mocker.patch("src.apps.auth.otp.verify_otp_code", wraps=verify_otp_code)
+    store = SQLOtpStore()
+    expires_at = datetime.now() + timedelta(minutes=2)
+
+    async def verify(otp_code: str) -> bool:
+        otp = await store.get(overrides_get_db, "guess@gmail.com")
+        return await store.verify(overrides_get_db, otp, otp_code, datetime.now())
+
+    await store.issue(overrides_get_db, "guess@gmail.com", "111111", expires_at)
+    assert await verify("000000") is False
+    assert await verify("000001") is False
+
+    # Out of attempts, even the right code is rejected without being compared.
+    assert await verify("111111") is False
+    assert mock_verify_otp_code.call_count == 2
+
+    # A new code gets a fresh count.
+    await store.issue(overrides_get_db, "guess@gmail.com", "222222", expires_at)
+    assert await verify("222222") is True
+
+    otp = await store.get(overrides_get_db, "guess@gmail.com")
+
+    await store.consume(overrides_get_db, otp)
+    await overrides_get_db.commit()
+
+
+@pytest.mark.asyncio
+async def test_refresh_token_success(anon_client, overrides_get_db, generate_test_user):
+    refresh_token = await issue_refresh_token(overrides_get_db, generate_test_user, timedelta(hours=24))
 
     response = await anon_client.post("/auth/refresh", json={"refresh_token": refresh_token})
 
@@ -226,10 +431,10 @@ async def test_refresh_token_success(anon_client, generate_test_user):
 @pytest.mark.asyncio
 async def test_refresh_token_invalid_user(anon_client):
     refresh_token = create_jwt_token(
-        1873,
-        "doesnotexists@gmail.com",
+        User(id=1873, email="doesnotexists@gmail.com", role=UserRoles.user, is_active=True),
         "refresh",
-        expires_at=timedelta(hours=24)
+        expires_at=timedelta(hours=24),
+        family="unknown-family"
     )
 
     response = await anon_client.post("/auth/refresh", json={"refresh_token": refresh_token})
@@ -241,8 +446,7 @@ async def test_refresh_token_invalid_user(anon_client):
 @pytest.mark.asyncio
 async def test_refresh_token_invalid_token_type(anon_client, generate_test_user):
     refresh_token = create_jwt_token(
-        generate_test_user.id,
-        generate_test_user.email,
+        generate_test_user,
         "access",
         expires_at=timedelta(hours=24)
     )
@@ -256,8 +460,7 @@ async def test_refresh_token_invalid_token_type(anon_client, generate_test_user)
 @pytest.mark.asyncio
 async def test_refresh_token_expired_token(anon_client, generate_test_user):
     refresh_token = create_jwt_token(
-        generate_test_user.id,
-        generate_test_user.email,
+        generate_test_user,
         "access",
         expires_at=timedelta(hours=-24)
     )
@@ -269,13 +472,8 @@ async def test_refresh_token_expired_token(anon_client, generate_test_user):
 
 
 @pytest.mark.asyncio
-async def test_refresh_token_inactive_user(anon_client, generate_inactive_user):
-    refresh_token = create_jwt_token(
-        generate_inactive_user.id,
-        generate_inactive_user.email,
-        "refresh",
-        expires_at=timedelta(hours=24)
-    )
+async def test_refresh_token_inactive_user(anon_client, overrides_get_db, generate_inactive_user):
+    refresh_token = await issue_refresh_token(overrides_get_db, generate_inactive_user, timedelta(hours=24))
 
     response = await anon_client.post("/auth/refresh", json={"refresh_token": refresh_token})
 
@@ -284,18 +482,188 @@ async def test_refresh_token_inactive_user(anon_client, generate_inactive_user):
 
 
 @pytest.mark.asyncio
-async def test_refresh_token_blocked_refresh(anon_client, generate_test_user, mocker):
-    mock_get_or_create = mocker.patch("src.apps.auth.router.get_or_create")
-    mock_get_or_create.return_value = (mocker.ANY, False)
+async def test_refresh_token_blocked_refresh(anon_client, overrides_get_db, generate_test_user, mocker):
+    mocker.patch("src.apps.auth.router.rotate_refresh_token", return_value=None)
 
-    refresh_token = create_jwt_token(
-        generate_test_user.id,
-        generate_test_user.email,
-        "refresh",
-        expires_at=timedelta(hours=24)
-    )
+    refresh_token = await issue_refresh_token(overrides_get_db, generate_test_user, timedelta(hours=24))
 
     response = await anon_client.post("/auth/refresh", json={"refresh_token": refresh_token})
 
     assert response.status_code == 403
     assert response.json() == {'data': {'errors': 'Blocked refresh token.'}}
+
+
+@pytest.mark.asyncio
+async def test_refresh_token_reuse_revokes_family(anon_client, overrides_get_db, generate_test_user):
+    first_token = await issue_refresh_token(overrides_get_db, generate_test_user, timedelta(hours=24))
+
+    rotated = await anon_client.post("/auth/refresh", cookies={"refresh_token": first_token})
+    second_token = rotated.cookies["refresh_token"]
+    anon_client.cookies.clear()
+    replayed = await anon_client.post("/auth/refresh", cookies={"refresh_token": first_token})
+    anon_client.cookies.clear()
+    revoked = await anon_client.post("/auth/refresh", cookies={"refresh_token": second_token})
+    anon_client.cookies.clear()
+
+    assert rotated.status_code == 200
+    assert replayed.status_code == 403
+    assert revoked.status_code == 403
+    assert revoked.json() == {'data': {'errors': 'Blocked refresh token.'}}
+
+
+@pytest.mark.asyncio
+async def test_sql_refresh_token_family_store(overrides_get_db):
+    store = SQLRefreshTokenFamilyStore()
+    await store.start(overrides_get_db, "family", 4_000_000_000)
+
+    assert await store.rotate(overrides_get_db, "family", 0, 4_000_000_000) is True
+    assert await store.rotate(overrides_get_db, "family", 1, 4_000_000_000) is True
+    assert await store.rotate(overrides_get_db, "family", 1, 4_000_000_000) is False
+    assert await store.rotate(overrides_get_db, "family", 2, 4_000_000_000) is False
+    assert await store.rotate(overrides_get_db, "unknown", 0, 4_000_000_000) is False
+
+
+@pytest.mark.asyncio
+async def test_decode_access_token_is_cached(mocker):
+    access_token = create_jwt_token(User(id=1, email="testuser@gmail.com", role=UserRoles.user, is_active=True), "access")
+    mock_decode = mocker.patch("src.apps.auth.tokens._verify_access_token", wraps=_verify_access_token)
+
+    first = decode_access_token(access_token)
+    second = decode_access_token(access_token)
+
+    assert first == second
+    assert first["sub"] == "1"
+    mock_decode.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_decode_access_token_caches_rejections(mocker):
+    refresh_token = create_jwt_token(
+        User(id=1, email="testuser@gmail.com", role=UserRoles.user, is_active=True), "refresh", family="test-family"
+    )
+    mock_decode = mocker.patch("src.apps.auth.tokens._verify_access_token", wraps=_verify_access_token)
+
+    for _ in range(2):
+        with pytest.raises(HTTPException) as exc:
+            decode_access_token(refresh_token)
+        assert exc.value.detail == "Authentication failed, invalid token type."
+
+    mock_decode.assert_called_once()
+
+
+def test_create_refresh_token_requires_family():
+    with pytest.raises(ValueError):
+        create_jwt_token(User(id=1, email="testuser@gmail.com", role=UserRoles.user, is_active=True), "refresh")
+
+
+@pytest.mark.asyncio
+async def test_jwks_endpoint(anon_client):
+    response = await anon_client.get("/.well-known/jwks.json")
+
+    assert response.status_code == 200
+    assert response.json() == {"keys": []}
+    assert response.headers["Cache-Control"].startswith("public")
+
+
+def test_key_ring_rotation():
+    old_key = OKPKey.generate_key("Ed25519", {"kid": "old"}, is_private=True)
+    new_key = OKPKey.generate_key("Ed25519", {"kid": "new"}, is_private=True)
+
+    token = KeyRing("EdDSA", [old_key]).encode({"sub": "1", "exp": 4_000_000_000})
+    rotated = KeyRing("EdDSA", [new_key, old_key])
+
+    assert rotated.decode(token)["sub"] == "1"
+    assert [key["kid"] for key in rotated.jwks()["keys"]] == ["new", "old"]
+    assert "d" not in rotated.jwks()["keys"][0]
+
+    with pytest.raises(InvalidTokenError):
+        KeyRing("EdDSA", [new_key]).decode(token)
+
+
+@pytest.mark.parametrize("key_ring", [
+    KeyRing("HS256", [OctKey.import_key("test-secret")]),
+    KeyRing("EdDSA", [OKPKey.generate_key("Ed25519", {"kid": "test"}, is_private=True)]),
+])
+def test_native_backend_matches_authlib(key_ring):
+    native = NativeBackend(key_ring)
+    payload = {"sub": "1", "typ": "access", "ver": 0, "exp": 4_000_000_000}
+
+    assert native.encode(payload) == key_ring.encode(payload)
+    assert native.decode(key_ring.encode(payload)) == payload
+    assert key_ring.decode(native.encode(payload)) == payload
+
+
+def test_native_backend_rejects_invalid_tokens():
+    native = NativeBackend(KeyRing("HS256", [OctKey.import_key("test-secret")]))
+    other = NativeBackend(KeyRing("HS256", [OctKey.import_key("other-secret")]))
+
+    for token in (
+        native.encode({"sub": "1", "exp": 1}),
+        other.encode({"sub": "1", "exp": 4_000_000_000}),
+        native.encode({"sub": "1"}),
+        "not-a-token",
+    ):
+        with pytest.raises(InvalidTokenError):
+            native.decode(token)
+
+
+@pytest.mark.asyncio
+async def test_delete_in_batches(overrides_get_db):
+    now = datetime.now()
+    overrides_get_db.add_all(
+        [Otp(email=f"expired{i}@gmail.com", expires_at=now - timedelta(days=2)) for i in range(5)]
+        + [Otp(email="live@gmail.com", expires_at=now + timedelta(minutes=2))]
+    )
+    await overrides_get_db.commit()
+
+    deleted = await delete_in_batches(overrides_get_db, Otp, Otp.expires_at < now - timedelta(days=1), batch_size=2)
+    remaining = (await overrides_get_db.scalars(select(Otp.email))).all()
+
+    assert deleted == 5
+    assert remaining == ["live@gmail.com"]
+
+    await delete_in_batches(overrides_get_db, Otp, Otp.email == "live@gmail.com", batch_size=2)
+
+
+@pytest.mark.asyncio
+async def test_generate_and_send_otp_writes_outbox(overrides_get_db, mocker):
+    mocker.patch("src.apps.auth.services.configs.EMAIL_TRANSPORT", "outbox")
+    mock_send_email = mocker.patch("src.apps.auth.services.send_otp_code_email.delay")
+    mocker.patch("src.apps.auth.services.randint", return_value=123456)
+
+    await generate_and_send_otp(overrides_get_db, "outbox@gmail.com")
+
+    message = (await overrides_get_db.scalars(select(EmailOutbox))).one()
+    assert message.recipient == "outbox@gmail.com"
+    assert "123456" not in message.body
+    assert "123456" in open_body(message.body)
+    assert (await overrides_get_db.scalars(select(Otp).where(Otp.email == "outbox@gmail.com"))).one() is not None
+    mock_send_email.assert_not_called()
+
+    await overrides_get_db.execute(delete(EmailOutbox))
+    await overrides_get_db.execute(delete(Otp))
+    await overrides_get_db.commit()
+
+
+@pytest.mark.asyncio
+async def test_relay_email_outbox(overrides_get_db, mocker):
+    overrides_get_db.add_all([
+        EmailOutbox(recipient="first@gmail.com", subject="subject", body=seal_body("body")),
+        EmailOutbox(recipient="second@gmail.com", subject="subject", body=seal_body("body")),
+        EmailOutbox(recipient="third@gmail.com", subject="subject", body="not sealed"),
+    ])
+    await overrides_get_db.commit()
+    handler = mocker.Mock()
+    handler.send_emails.return_value = [1]
+
+    assert await relay_email_outbox(overrides_get_db, handler, batch_size=10) == 3
+
+    handler.send_emails.assert_called_once_with(
+        [("first@gmail.com", "subject", "body"), ("second@gmail.com", "subject", "body")]
+    )
+    message = (await overrides_get_db.scalars(select(EmailOutbox))).one()
+    assert message.recipient == "second@gmail.com"
+    assert message.attempts == 1
+
+    await overrides_get_db.execute(delete(EmailOutbox))
+    await overrides_get_db.commit()
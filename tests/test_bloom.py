@@ -0,0 +1,10 @@
+from src.core.bloom import BloomFilter
+
+
+def test_bloom_filter():
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    for user_id in range(1000):
+        bloom.add(f"{user_id}:0")
+
+    assert all(f"{user_id}:0" in bloom for user_id in range(1000))
+    assert sum(f"{user_id}:1" in bloom for user_id in range(10_000)) < 300
@@ -0,0 +1,64 @@
+import pytest
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src.apps.auth.services import route_user_reads
+from src.apps.users.models import User
+from src.core.settings import configs
+from src.infrastructure.database import ReplicaSet, SessionLocal, engine, read_routing
+
+
+async def get_bind(db, clause):
+    return await db.run_sync(lambda session: session.get_bind(clause=clause))
+
+
+@pytest.mark.asyncio
+async def test_routing_session_reads_from_replicas_until_it_writes(mocker):
+    replica = create_async_engine(configs.DATABASE_URL)
+    mocker.patch("src.infrastructure.database.replica_set", ReplicaSet([replica], retry_after=30))
+
+    async with SessionLocal() as db:
+        assert await get_bind(db, select(User)) is replica.sync_engine
+        assert await get_bind(db, select(User).with_for_update()) is engine.sync_engine
+        assert await get_bind(db, select(User).execution_options(read_from_primary=True)) is engine.sync_engine
+        with read_routing(primary=True):
+            assert await get_bind(db, select(User)) is engine.sync_engine
+
+    async with SessionLocal() as db:
+        with read_routing() as routing:
+            await get_bind(db, update(User))
+            assert await get_bind(db, select(User)) is engine.sync_engine
+        assert routing.wrote is True
+
+    await replica.dispose()
+
+
+@pytest.mark.asyncio
+async def test_routing_session_falls_back_to_primary_when_replicas_fail(mocker):
+    replica = create_async_engine("sqlite+aiosqlite:////nonexistent/replica.sqlite3")
+    replicas = ReplicaSet([replica], retry_after=30)
+    mocker.patch("src.infrastructure.database.replica_set", replicas)
+
+    async with SessionLocal() as db:
+        assert (await db.execute(select(1))).scalar() == 1
+        assert await get_bind(db, select(User)) is engine.sync_engine
+    assert replicas.choose() is None
+
+    await replica.dispose()
+
+
+@pytest.mark.asyncio
+async def test_reads_stick_to_primary_after_a_user_wrote(mocker):
+    mocker.patch("src.apps.auth.services.replica_set", [object()])
+    mock_redis = mocker.patch("src.apps.auth.services.redis_fastapi")
+    mock_redis.exists = mocker.AsyncMock(side_effect=[0, 1])
+
+    with read_routing() as routing:
+        await route_user_reads(7)
+    assert routing.user_id == 7
+    assert routing.primary is False
+
+    with read_routing() as routing:
+        await route_user_reads(7)
+    assert routing.primary is True
+    mock_redis.exists.assert_called_with("user:7:recent_write")
@@ -0,0 +1,96 @@
+import asyncio
+from smtplib import SMTPRecipientsRefused
+
+import pytest
+
+from src.apps.email_batcher import EmailBatcher
+from src.apps.tasks import send_otp_code_emails
+from src.core.metrics import MetricsRegistry
+from src.infrastructure.email_handler import SMTPConnectionPool, EmailHandler
+from src.infrastructure.email_transport import AsyncEmailTransport, EmailQueueFull
+
+
+def test_smtp_connection_pool_reuses_sessions(mocker):
+    mocker.patch("src.infrastructure.email_handler.configs.EMAIL_USE_TLS", False)
+    mock_smtp = mocker.patch("src.infrastructure.email_handler.SMTP")
+    mock_smtp.return_value.noop.return_value = (250, b"OK")
+    handler = EmailHandler(SMTPConnectionPool(size=1, max_idle=60))
+
+    handler.send_email("first@gmail.com", "subject", "body")
+    handler.send_email("second@gmail.com", "subject", "body")
+
+    assert mock_smtp.call_count == 1
+    assert mock_smtp.return_value.login.call_count == 1
+    assert mock_smtp.return_value.send_message.call_count == 2
+
+    # Once the session stops answering, the next message goes over a new one.
+    mocker.patch("src.infrastructure.email_handler.NOOP_AFTER", 0)
+    mock_smtp.return_value.noop.side_effect = OSError
+    handler.send_email("third@gmail.com", "subject", "body")
+
+    assert mock_smtp.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_email_batcher_flushes_on_size_and_window(mocker):
+    mock_send_batch = mocker.patch("src.apps.email_batcher.send_otp_code_emails.delay")
+    batcher = EmailBatcher(window=0.01, size=2)
+
+    batcher.add("first@gmail.com", "111111")
+    batcher.add("second@gmail.com", "222222")
+    mock_send_batch.assert_called_once_with([("first@gmail.com", "111111"), ("second@gmail.com", "222222")])
+
+    batcher.add("third@gmail.com", "333333")
+    await asyncio.sleep(0.05)
+    mock_send_batch.assert_called_with([("third@gmail.com", "333333")])
+    assert mock_send_batch.call_count == 2
+
+
+def test_send_otp_code_emails_retries_failed_messages_individually(mocker):
+    mocker.patch("src.infrastructure.email_handler.configs.EMAIL_USE_TLS", False)
+    mock_smtp = mocker.patch("src.infrastructure.email_handler.SMTP")
+    mock_smtp.return_value.send_message.side_effect = [None, SMTPRecipientsRefused({}), None]
+    mocker.patch("src.apps.tasks.EmailHandler", return_value=EmailHandler(SMTPConnectionPool(size=1, max_idle=60)))
+    mock_send_one = mocker.patch("src.apps.tasks.send_otp_code_email.apply_async")
+
+    send_otp_code_emails([("first@gmail.com", "111111"), ("second@gmail.com", "222222"), ("third@gmail.com", "333333")])
+
+    assert mock_smtp.call_count == 1
+    mock_send_one.assert_called_once_with(("second@gmail.com", "222222"), headers={"enqueued_at": mocker.ANY})
+
+
+@pytest.mark.asyncio
+async def test_async_email_transport_retries_and_drains(mocker):
+    mocker.patch("src.infrastructure.email_transport.configs.EMAIL_RETRY_BACKOFF", 0)
+    mocker.patch("src.infrastructure.email_transport.email_delivery_seconds")
+    transport = AsyncEmailTransport(queue_size=1, senders=1, registry=MetricsRegistry())
+    mock_send_email = mocker.patch.object(transport.handler, "send_email", side_effect=[OSError, None])
+    transport.start()
+
+    transport.send("first@gmail.com", "subject", "body")
+    with pytest.raises(EmailQueueFull):
+        transport.send("second@gmail.com", "subject", "body")
+
+    await asyncio.sleep(0.05)
+    await transport.stop()
+
+    assert mock_send_email.call_count == 2
+    mock_send_email.assert_called_with("first@gmail.com", "subject", "body")
+
+
+@pytest.mark.asyncio
+async def test_async_email_transport_stop_sends_pending_retries(mocker):
+    mocker.patch("src.infrastructure.email_transport.retry_delay", return_value=60)
+    mocker.patch("src.infrastructure.email_transport.email_delivery_seconds")
+    transport = AsyncEmailTransport(queue_size=1, senders=1, registry=MetricsRegistry())
+    mock_send_email = mocker.patch.object(transport.handler, "send_email", side_effect=[OSError, None])
+    transport.start()
+
+    transport.send("first@gmail.com", "subject", "body")
+    await asyncio.sleep(0.05)
+    assert len(transport.retries) == 1
+
+    await transport.stop()
+
+    assert mock_send_email.call_count == 2
+    assert transport.retries == {}
@@ -0,0 +1,70 @@
+import asyncio
+import threading
+
+import pytest
+
+from src.apps.users.models import User
+from src.core import hashing
+from src.core.hashing import HashingScheduler, HashingOverloaded
+from src.core.metrics import MetricsRegistry
+
+
+@pytest.mark.asyncio
+async def test_hashing_scheduler_rejects_when_queue_is_full():
+    scheduler = HashingScheduler(
+        max_concurrency=4,
+        memory_budget_kib=64 * 1024,
+        memory_per_hash_kib=64 * 1024,
+        max_queue=1,
+        registry=MetricsRegistry()
+    )
+    release = threading.Event()
+
+    running = asyncio.create_task(scheduler.run(release.wait))
+    queued = asyncio.create_task(scheduler.run(release.wait))
+    await asyncio.sleep(0.05)
+
+    assert scheduler.permits == 1
+    assert scheduler.waiting == 1
+
+    with pytest.raises(HashingOverloaded):
+        await scheduler.run(release.wait)
+
+    release.set()
+    await asyncio.gather(running, queued)
+
+    assert scheduler.rejected.value == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("name", ["hash_password", "verify_password"])
+async def test_password_hashing_runs_on_the_executor(mocker, name):
+    threads = []
+    original = getattr(hashing, name)
+
+    def record_thread(*args):
+        threads.append(threading.current_thread().name)
+        return original(*args)
+
+    mocker.patch(f"src.core.hashing.{name}", side_effect=record_thread)
+    encoded = hashing.hash_password("new@userPassword1")
+
+    if name == "hash_password":
+        await hashing.hash_async("new@userPassword1")
+    else:
+        await hashing.verify_async(encoded, "new@userPassword1")
+
+    assert threads[-1].startswith("password-hasher")
+    assert threads[-1] != threading.current_thread().name
+
+
+@pytest.mark.asyncio
+async def test_set_password_async_round_trip():
+    user = User(username="asyncuser", email="asyncuser@gmail.com", password="!")
+
+    await user.set_password_async("new@userPassword1")
+
+    assert user.password != "new@userPassword1"
+    assert await user.verify_password_async("new@userPassword1")
+    assert not await user.verify_password_async("wrong@userPassword1")
+    assert user.verify_password("new@userPassword1")
@@ -1,8 +1,51 @@
 import pytest
 
+from src.core.hashing import HashingOverloaded
+from src.core.settings import configs
+from src.infrastructure.email_transport import EmailQueueFull
+
 
 @pytest.mark.asyncio
 async def test_health_check(anon_client):
     response = await anon_client.get("/health-check")
 
     assert response.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_metrics(anon_client):
+    response = await anon_client.get("/metrics", headers={"Authorization": f"Bearer {configs.METRICS_TOKEN}"})
+
+    assert response.status_code == 200
+    assert "password_hashing_queue_depth" in response.text
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("headers", [{}, {"Authorization": "Bearer wrong-token"}])
+async def test_metrics_without_token(anon_client, headers):
+    response = await anon_client.get("/metrics", headers=headers)
+
+    assert response.status_code == 401
+
+
+@pytest.mark.asyncio
+async def test_metrics_disabled(anon_client, monkeypatch):
+    monkeypatch.setattr(configs, "METRICS_TOKEN", None)
+
+    response = await anon_client.get("/metrics", headers={"Authorization": "Bearer test-metrics-token"})
+
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("busy", [HashingOverloaded, EmailQueueFull])
+async def test_busy_service_returns_service_unavailable(anon_client, mocker, busy):
+    mocker.patch("src.apps.auth.router.authenticate_user", side_effect=busy(retry_after=3))
+
+    response = await anon_client.post(
+        "/auth/login",
+        json={"email": "testuser@gmail.com", "password": "new@userPassword1"}
+    )
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "3"
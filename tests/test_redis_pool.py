@@ -0,0 +1,9 @@
+from src.core.settings import configs
+from src.infrastructure.redis_pool import redis_sync
+
+
+def test_sync_redis_client_times_out():
+    connection_kwargs = redis_sync.connection_pool.connection_kwargs
+
+    assert connection_kwargs["socket_timeout"] == configs.REDIS_SYNC_TIMEOUT
+    assert connection_kwargs["socket_connect_timeout"] == configs.REDIS_SYNC_TIMEOUT
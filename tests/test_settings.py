@@ -0,0 +1,9 @@
+import pytest
+from pydantic import ValidationError
+
+from src.core.settings import TestConfig
+
+
+def test_token_version_cache_must_outlive_access_tokens():
+    with pytest.raises(ValidationError):
+        TestConfig(TOKEN_VERSION_CACHE_TTL=60, ALLOWED_ORIGINS=["*"])
@@ -1,12 +1,20 @@
+import base64
+import json
 from datetime import datetime, timedelta
 
 import pytest
 from fastapi import HTTPException
+from redis.exceptions import RedisError
 from sqlalchemy import select
 
 from src.apps.auth.models import Otp
-from src.apps.auth.services import create_jwt_token
+from src.apps.auth.revocation import revocation_filter, RevocationFilter
+from src.apps.auth.tokens import create_jwt_token
 from src.apps.users.models import User
+from src.apps.users.repository import get_all_users, USER_LIST_KEYS
+from src.core.bloom import BloomFilter
+from src.core.metrics import MetricsRegistry
+from src.core.pagination import KeysetPaginator
 from tests.conftest import overrides_get_db, anon_client
 
 
@@ -33,6 +41,67 @@ async def test_list_users_pagination(admin_auth_client, generate_test_user):
     assert len(response.json()["data"]["items"]) == 1
 
 
+@pytest.mark.asyncio
+async def test_list_users_cursor_pagination(admin_auth_client):
+    response = await admin_auth_client.get("/users", params={"per_page": 1, "cursor": ""})
+
+    assert response.status_code == 200
+    assert len(response.json()["data"]["items"]) == 1
+    assert response.json()["data"]["count"] is None
+    assert response.json()["data"]["previous_cursor"] is None
+
+
+@pytest.mark.asyncio
+async def test_keyset_paginator_walks_both_ways(overrides_get_db):
+    created_at = datetime.now()
+    users = [
+        User(username=f"cursoruser{i}", email=f"cursoruser{i}@gmail.com", password="!", created_at=created_at)
+        for i in range(3)
+    ]
+    overrides_get_db.add_all(users)
+    await overrides_get_db.commit()
+
+    async def get_page(cursor: str | None) -> dict:
+        query = get_all_users().where(User.username.startswith("cursoruser"))
+        return await KeysetPaginator(overrides_get_db, query, USER_LIST_KEYS, cursor, per_page=2).get_response()
+
+    # Rows sharing a created_at are ordered by id.
+    first_page = await get_page(None)
+    assert first_page["items"] == users[:2]
+    assert first_page["previous_cursor"] is None
+
+    second_page = await get_page(first_page["next_cursor"])
+    assert second_page["items"] == users[2:]
+    assert second_page["next_cursor"] is None
+
+    previous_page = await get_page(second_page["previous_cursor"])
+    assert previous_page["items"] == users[:2]
+    assert previous_page["previous_cursor"] is None
+    assert previous_page["next_cursor"] is not None
+
+    for user in users:
+        await overrides_get_db.delete(user)
+    await overrides_get_db.commit()
+
+
+@pytest.mark.asyncio
+async def test_list_users_invalid_cursor(admin_auth_client):
+    response = await admin_auth_client.get("/users", params={"cursor": "not-a-cursor"})
+
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("position", [["2024-01-01T00:00:00", "x"], ["2024-01-01T00:00:00", True],
+                                      ["2024-01-01T00:00:00", [1]], [1, 1]])
+async def test_list_users_cursor_with_invalid_values(admin_auth_client, position):
+    cursor = base64.urlsafe_b64encode(json.dumps(["next", position]).encode()).decode()
+
+    response = await admin_auth_client.get("/users", params={"cursor": cursor})
+
+    assert response.status_code == 400
+
+
 @pytest.mark.asyncio
 async def test_list_users_not_admin_user(user_auth_client):
     response = await user_auth_client.get("/users")
@@ -59,7 +128,7 @@ async def test_user_profile_success(user_auth_client):
 
 @pytest.mark.asyncio
 async def test_user_profile_inactive_user(anon_client, generate_inactive_user):
-    auth_token = create_jwt_token(generate_inactive_user.id, generate_inactive_user.email, "access")
+    auth_token = create_jwt_token(generate_inactive_user, "access")
 
     anon_client.headers["Authorization"] = f"Bearer {auth_token}"
 
@@ -72,7 +141,7 @@ async def test_user_profile_inactive_user(anon_client, generate_inactive_user):
 @pytest.mark.asyncio
 async def test_request_otp_to_reset_password_success(anon_client, mocker, generate_test_user):
     mock_generate_otp = mocker.patch("src.apps.auth.services.generate_otp")
-    mock_generate_otp.return_value = (mocker.ANY, "123456", "hashed_code", True, datetime.now() + timedelta(minutes=2))
+    mock_generate_otp.return_value = ("123456", True)
 
     mock_send_otp_task = mocker.patch("src.apps.auth.services.send_otp_code_email", return_value=None)
     mock_send_otp_task.delay = mocker.MagicMock()
@@ -133,7 +202,9 @@ async def test_request_otp_to_reset_password_invalid_email(anon_client):
 
 
 @pytest.mark.asyncio
-async def test_set_password_success(overrides_get_db, anon_client, mocker, generate_test_otp, generate_test_user):
+async def test_set_password_success(
+        overrides_get_db, anon_client, mocker, generate_test_otp, generate_test_user, token_version_announcements
+):
     mock_get_otp = mocker.patch("src.apps.users.router.get_otp_by_email", return_value=generate_test_otp)
 
     mock_otp_validator = mocker.patch("src.apps.users.router.is_otp_valid", return_value=True)
@@ -150,7 +221,7 @@ async def test_set_password_success(overrides_get_db, anon_client, mocker, gener
     await overrides_get_db.refresh(generate_test_user)
 
     mock_get_otp.assert_called_once_with(mocker.ANY, "testuser@gmail.com")
-    mock_otp_validator.assert_called_once_with("123456", generate_test_otp)
+    mock_otp_validator.assert_called_once_with(mocker.ANY, "123456", generate_test_otp)
 
     assert response.status_code == 200
     assert generate_test_user.verify_password("@userNewPassword1")
@@ -213,7 +284,9 @@ async def test_set_password_otp_code_invalid(overrides_get_db, anon_client, gene
 
 
 @pytest.mark.asyncio
-async def test_change_password_success(overrides_get_db, user_auth_client, generate_test_user):
+async def test_change_password_success(
+        overrides_get_db, user_auth_client, generate_test_user, token_version_announcements
+):
     request_data = {
         "old_password": "new@userPassword1",
         "new_password": "@userNewPassword1",
@@ -227,6 +300,90 @@ async def test_change_password_success(overrides_get_db, user_auth_client, gener
     assert generate_test_user.verify_password("@userNewPassword1")
 
 
+@pytest.mark.asyncio
+async def test_change_password_revokes_issued_tokens(
+        overrides_get_db, user_auth_client, generate_test_user, token_version_announcements
+):
+    request_data = {
+        "old_password": "new@userPassword1",
+        "new_password": "@userNewPassword1",
+        "confirm_password": "@userNewPassword1"
+    }
+    response = await user_auth_client.post("/users/profile/password/change", json=request_data)
+    assert response.status_code == 200
+
+    response = await user_auth_client.get("/users/profile")
+
+    assert response.status_code == 401
+    assert response.json() == {'data': {'errors': 'Authentication failed, token has been revoked.'}}
+
+
+@pytest.mark.asyncio
+async def test_set_password_statement_count(
+        anon_client, generate_test_user, otp_factory, sql_statements, token_version_announcements
+):
+    await otp_factory("testuser@gmail.com")
+    sql_statements.clear()
+
+    request_data = {
+        "email": "testuser@gmail.com",
+        "otp_code": "123456",
+        "new_password": "@userNewPassword1",
+        "confirm_password": "@userNewPassword1"
+    }
+    response = await anon_client.post("/users/profile/password/set", json=request_data)
+
+    assert response.status_code == 200
+    # Load the code, count the attempt, load the user, then update the user and delete the code.
+    assert len(sql_statements) == 7
+    assert sql_statements.count("COMMIT") == 2
+
+
+@pytest.mark.asyncio
+async def test_activate_account_statement_count(anon_client, generate_inactive_user, otp_factory, sql_statements):
+    await otp_factory("inactiveuser@gmail.com")
+    sql_statements.clear()
+
+    request_data = {"email": "inactiveuser@gmail.com", "otp_code": "123456"}
+    response = await anon_client.post("/users/profile/activate", json=request_data)
+
+    assert response.status_code == 200
+    # Load the code, count the attempt, lock the user, then update the user and delete the code.
+    assert len(sql_statements) == 7
+    assert sql_statements.count("COMMIT") == 2
+
+
+@pytest.mark.asyncio
+async def test_revocation_filter_publish_failure_is_raised(mocker):
+    client = mocker.MagicMock()
+    client.publish = mocker.AsyncMock(side_effect=RedisError)
+    revocations = RevocationFilter(capacity=100, error_rate=0.01, registry=MetricsRegistry())
+
+    with pytest.raises(RedisError):
+        await revocations.publish(client, 7, 2)
+    # This worker still knows.
+    assert "7:1" in revocations.bloom
+
+
+@pytest.mark.asyncio
+async def test_revocation_filter_skips_token_version_lookup(user_auth_client, generate_test_user, mocker):
+    mocker.patch.object(revocation_filter, "ready", True)
+    mocker.patch.object(revocation_filter, "bloom", BloomFilter(capacity=1000, error_rate=0.001))
+    mock_get_token_version = mocker.patch(
+        "src.apps.auth.services.get_token_version", return_value=generate_test_user.token_version + 1
+    )
+
+    response = await user_auth_client.get("/users/profile")
+    assert response.status_code == 200
+    mock_get_token_version.assert_not_called()
+
+    revocation_filter.add(generate_test_user.id, generate_test_user.token_version + 1)
+    response = await user_auth_client.get("/users/profile")
+
+    assert response.status_code == 401
+    mock_get_token_version.assert_called_once()
+
+
 @pytest.mark.asyncio
 async def test_change_password_incorrect_password(overrides_get_db, user_auth_client, generate_test_user):
     request_data = {
@@ -277,18 +434,23 @@ async def test_change_password_passwords_does_not_match(overrides_get_db, user_a
 
 
 @pytest.mark.asyncio
-async def test_user_update_profile_without_email_success(overrides_get_db, generate_test_user, user_auth_client):
+async def test_user_update_profile_without_email_success(
+        overrides_get_db, generate_test_user, user_auth_client, token_version_announcements
+):
     response = await user_auth_client.put("/users/profile/update", json={"username": "updatedusername"})
     await overrides_get_db.refresh(generate_test_user)
 
     assert response.status_code == 200
     assert generate_test_user.username == "updatedusername"
+    token_version_announcements.assert_not_awaited()
 
 
 @pytest.mark.asyncio
-async def test_user_update_profile_with_email(overrides_get_db, generate_test_user, user_auth_client, mocker):
+async def test_user_update_profile_with_email(
+        overrides_get_db, generate_test_user, user_auth_client, mocker, token_version_announcements
+):
     mock_generate_otp = mocker.patch("src.apps.auth.services.generate_otp")
-    mock_generate_otp.return_value = (mocker.ANY, "123456", "hashed_code", True, datetime.now() + timedelta(minutes=2))
+    mock_generate_otp.return_value = ("123456", True)
 
     mock_send_otp_task = mocker.patch("src.apps.auth.services.send_otp_code_email", return_value=None)
     mock_send_otp_task.delay = mocker.MagicMock()
@@ -305,6 +467,7 @@ async def test_user_update_profile_with_email(overrides_get_db, generate_test_us
     assert generate_test_user.email == "updatedemail@gmail.com"
     assert generate_test_user.username == "updatedusername"
     assert not generate_test_user.is_active
+    token_version_announcements.assert_awaited_once()
 
 
 @pytest.mark.asyncio
@@ -353,7 +516,7 @@ async def test_activate_user_success(
     await overrides_get_db.refresh(generate_inactive_user)
 
     mock_get_otp.assert_called_once_with(mocker.ANY, "inactiveuser@gmail.com")
-    mock_otp_validator.assert_called_once_with("123456", generate_test_otp)
+    mock_otp_validator.assert_called_once_with(mocker.ANY, "123456", generate_test_otp)
 
     assert response.status_code == 200
     assert generate_inactive_user.is_active
@@ -406,13 +569,16 @@ async def test_activate_user_otp_invalid(
 
 
 @pytest.mark.asyncio
-async def test_delete_user_account_success(overrides_get_db, generate_test_user, user_auth_client):
+async def test_delete_user_account_success(
+        overrides_get_db, generate_test_user, user_auth_client, token_version_announcements
+):
     response = await user_auth_client.delete("/users/profile/delete")
 
     assert response.status_code == 204
     assert (
                await overrides_get_db.scalars(select(User).where(User.email == "testuser@gmail.com"))
            ).one_or_none() is None
+    token_version_announcements.assert_awaited_once()
 
 
 @pytest.mark.asyncio